@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""夜間バッチ用のレポートCLI。
+
+ユーザーごとのシャードをProcessPoolExecutorに分配して集計し、完了したユーザーから順に出力する。
+
+    python cli.py profit --jobs 8 --format csv --output profit.csv
+    python cli.py chains --format jsonl
+    python cli.py check --data-dir /srv/sim/data
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+FORMATS = ('table', 'csv', 'jsonl')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='SIM契約データのレポートを出力します。')
+    parser.add_argument('report', choices=('profit', 'chains', 'plans', 'check'),
+                        help='profit: ユーザー別収支 / chains: 電話番号別チェーン要約 / plans: 乗り換え予定の最適化 / check: 整合性チェック')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1, help='並列に処理するプロセス数')
+    parser.add_argument('--format', '-f', choices=FORMATS, default='table', help='出力形式')
+    parser.add_argument('--output', '-o', help='出力先ファイル(省略時は標準出力)')
+    parser.add_argument('--user', '-u', type=int, action='append', dest='user_ids', help='対象ユーザーID(複数指定可)')
+    parser.add_argument('--data-dir', help='dataディレクトリ(省略時はSIM_DATA_DIRまたは./data)')
+    parser.add_argument('--no-progress', action='store_true', help='進捗バーを表示しない')
+    return parser.parse_args(argv)
+
+class RowWriter:
+    """CSV/JSONLは行が届くたびに書き出し、tableは最後にまとめてrichで描画する。"""
+
+    def __init__(self, fmt, stream, title):
+        self.fmt = fmt
+        self.stream = stream
+        self.title = title
+        self.rows = []
+        self._csv = None
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == 'jsonl':
+                self.stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+            elif self.fmt == 'csv':
+                if self._csv is None:
+                    self._csv = csv.DictWriter(self.stream, fieldnames=list(row))
+                    self._csv.writeheader()
+                self._csv.writerow(row)
+            else:
+                self.rows.append(row)
+        self.stream.flush()
+
+    def close(self):
+        if self.fmt != 'table':
+            return
+        from rich.console import Console
+        from rich.table import Table
+        table = Table(title=self.title)
+        columns = list(self.rows[0]) if self.rows else []
+        for column in columns:
+            table.add_column(column)
+        for row in sorted(self.rows, key=lambda r: [(r.get(c) is None, r.get(c) or 0) for c in columns[:2]]):
+            table.add_row(*(self._cell(c, row.get(c)) for c in columns))
+        Console(file=self.stream).print(table)
+
+    @staticmethod
+    def _cell(column, value):
+        if value is None:
+            return '-'
+        if isinstance(value, int) and not column.endswith('_id'):
+            return f'{value:,}'
+        return str(value)
+
+def iter_results(report, user_ids, jobs):
+    """(user_id, rows, error)を完了順に返す。jobsが1ならプロセスプールを使わない。
+
+    集計に失敗したユーザーはrowsがNoneでerrorに例外が入る。他のユーザーの集計は続ける。
+    """
+    from services.report_service import run_report
+    if jobs <= 1:
+        for user_id in user_ids:
+            try:
+                yield run_report(report, user_id) + (None,)
+            except Exception as e:
+                yield user_id, None, e
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(run_report, report, user_id): user_id for user_id in user_ids}
+        for future in as_completed(futures):
+            try:
+                yield future.result() + (None,)
+            except Exception as e:
+                yield futures[future], None, e
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.data_dir:
+        # Must be set before services.json_data_store is imported; worker processes inherit it
+        os.environ['SIM_DATA_DIR'] = os.path.abspath(args.data_dir)
+    from services.json_data_store import list_shard_user_ids
+    from services.startup import migrate_data_files
+
+    # A deployment that has not served a request since the upgrade still has monolithic files
+    migrate_data_files()
+    user_ids = args.user_ids or list_shard_user_ids()
+    stream = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    writer = RowWriter(args.format, stream, title=args.report)
+    row_count = 0
+    failed_user_ids = []
+    try:
+        from rich.console import Console
+        from rich.progress import Progress
+        # The bar goes to stderr so it never mixes with CSV/JSONL written to stdout
+        with Progress(console=Console(stderr=True), disable=args.no_progress, transient=True) as progress:
+            task = progress.add_task(f'{args.report}', total=len(user_ids))
+            for user_id, rows, error in iter_results(args.report, user_ids, args.jobs):
+                if error is not None:
+                    failed_user_ids.append(user_id)
+                    print(f'user {user_id}: {type(error).__name__}: {error}', file=sys.stderr)
+                else:
+                    writer.write(rows)
+                    row_count += len(rows)
+                progress.advance(task)
+        writer.close()
+    finally:
+        if args.output:
+            stream.close()
+    # 集計に失敗したユーザーがあれば終了コード2、checkで不整合が見つかった場合は1を返す
+    if failed_user_ids:
+        print(f'{args.report}: {len(failed_user_ids)} users failed: {", ".join(map(str, sorted(failed_user_ids)))}', file=sys.stderr)
+        return 2
+    return 1 if args.report == 'check' and row_count else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
+import os
 from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parents[1]
-DATA_DIR = BASE_DIR / "data"
+DATA_DIR = Path(os.environ.get('SIM_DATA_DIR') or BASE_DIR / "data")
+USERS_DIR = DATA_DIR / "users"
 CONTRACTS_FILE = DATA_DIR / "contracts.json"
 CARRIERS_FILE = DATA_DIR / "carriers.json"
 BACKUP_DIR = DATA_DIR / "backup"
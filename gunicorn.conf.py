@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# gunicorn -c gunicorn.conf.py "app:create_app()"
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+# The live dashboard holds one Server-Sent Events connection per open tab, so each worker serves
+# requests from a thread pool instead of one request at a time. At most LIVE_MAX_STREAMS threads per
+# worker go to streams (further tabs poll instead); keep threads well above it for ordinary requests.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+
+# Import the application (Flask, views, templates loader) once in the master and share it
+# copy-on-write with the workers instead of importing it again in every worker.
+preload_app = True
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before workers are forked,
+    # so the data-file check and default seeding happen exactly once.
+    from services.startup import ensure_initialized
+    ensure_initialized()
+
+def post_fork(server, worker):
+    from app import warm_up
+    warm_up(worker.app.wsgi())
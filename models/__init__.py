@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+# __init__.py
+from models.user import User
+from models.carrier import Carrier, Plan
+from models.contract import Contract
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+
+class Carrier:
+    def __init__(self, id, carrier_name, user_id):
+        self.id = id
+        self.carrier_name = carrier_name
+        self.user_id = user_id
+        self.plans = [] # Will be populated separately
+
+    @classmethod
+    def from_dict(cls, d):
+        carrier = cls(d.get('id'), d.get('carrier_name', ''), d.get('user_id'))
+        for plan_data in d.get('plans') or []:
+            carrier.plans.append(Plan.from_dict(plan_data, carrier_id=carrier.id))
+        return carrier
+
+
+class Plan:
+    def __init__(self, id, plan_name, initial_fee, minimum_maintenance_period, carrier_id):
+        self.id = id
+        self.plan_name = plan_name
+        self.initial_fee = initial_fee
+        self.minimum_maintenance_period = minimum_maintenance_period
+        self.carrier_id = carrier_id
+
+    @classmethod
+    def from_dict(cls, d, carrier_id=None):
+        return cls(
+            d.get('id'),
+            d.get('plan_name', ''),
+            d.get('initial_fee', 0),
+            d.get('minimum_maintenance_period', 0),
+            d.get('carrier_id', carrier_id),
+        )
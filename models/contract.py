@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+from utils.date_utils import parse_date, months_ceil_between
+
+# Contract.__init__が受け付けるフィールド。JSON上のそれ以外のキー(previous_contract_idなど)は無視する。
+CONTRACT_FIELDS = (
+    'id', 'contract_id', 'contract_date', 'scheduled_termination_date',
+    'phone_number', 'contractor_name', 'carrier_name', 'plan_name', 'sim_id_last_5_digits',
+    'initial_fee', 'first_month_cost', 'monthly_cost', 'cashback_amount', 'device_type',
+    'device_cost', 'device_resale_value', 'memo', 'user_id', 'version',
+)
+
+DATE_FIELDS = ('contract_date', 'scheduled_termination_date')
+
+
+class Contract:
+    def __init__(self, id, contract_id, contract_date, scheduled_termination_date,\
+                 phone_number, contractor_name, carrier_name, plan_name, sim_id_last_5_digits,
+                 initial_fee, first_month_cost, monthly_cost, cashback_amount, device_type,
+                 device_cost, device_resale_value, memo, user_id, version=None):
+        self.id = id
+        self.contract_id = contract_id
+        
+        self.contract_date = contract_date
+        self.scheduled_termination_date = scheduled_termination_date
+        self.phone_number = phone_number
+        self.contractor_name = contractor_name
+        self.carrier_name = carrier_name
+        self.plan_name = plan_name
+        self.sim_id_last_5_digits = sim_id_last_5_digits
+        self.initial_fee = initial_fee
+        self.first_month_cost = first_month_cost
+        self.monthly_cost = monthly_cost
+        self.cashback_amount = cashback_amount
+        self.device_type = device_type
+        self.device_cost = device_cost
+        self.device_resale_value = device_resale_value
+        self.memo = memo
+        self.user_id = user_id
+        # 最終更新時に付与されるバージョン(services.json_data_store.new_record_version)
+        self.version = version
+
+    @classmethod
+    def from_dict(cls, d):
+        """JSONの契約辞書からContractを生成する。日付文字列はdateに変換し、不正な日付はNoneとする。"""
+        kwargs = {field: d.get(field) for field in CONTRACT_FIELDS}
+        for field in DATE_FIELDS:
+            value = kwargs[field]
+            if value and not isinstance(value, date):
+                try:
+                    kwargs[field] = date.fromisoformat(value)
+                except (ValueError, TypeError):
+                    kwargs[field] = parse_date(value)
+        return cls(**kwargs)
+
+    def to_dict(self):
+        d = {field: getattr(self, field) for field in CONTRACT_FIELDS}
+        for field in DATE_FIELDS:
+            if isinstance(d[field], date):
+                d[field] = d[field].isoformat()
+        return d
+
+    def calculate_financials(self):
+        contract_duration_months = None # Initialize to None
+        if self.contract_date and self.scheduled_termination_date:
+            contract_duration_months = months_ceil_between(self.contract_date, self.scheduled_termination_date)
+
+        total_monthly_costs = 0
+        if contract_duration_months is not None:
+            total_monthly_costs = (self.monthly_cost or 0) * max(0, contract_duration_months - 1)
+
+        total_cost = (
+            (self.initial_fee or 0) +
+            (self.first_month_cost or 0) +
+            total_monthly_costs +
+            (self.device_cost or 0) -
+            (self.cashback_amount or 0) -
+            (self.device_resale_value or 0)
+        )
+        
+        # If contract_duration_months is None, total_cost should also be None
+        if contract_duration_months is None:
+            total_cost = None
+
+        return {
+            'contract_duration_months': contract_duration_months,
+            'total_cost': -total_cost if total_cost is not None else None # Negate only if not None
+        }
+
+    def calculate_duration_days(self):
+        if self.contract_date and self.scheduled_termination_date:
+            return (self.scheduled_termination_date - self.contract_date).days
+        return None
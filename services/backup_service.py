@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
 from pathlib import Path
-import shutil, datetime
-from config.settings import CONTRACTS_FILE, BACKUP_DIR
+import datetime
+from config.settings import BACKUP_DIR
+from services.json_data_store import ContractShard, save_data, user_contracts_file
 
-def make_backup():
-    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
-    if CONTRACTS_FILE.exists():
+def make_backup(user_id):
+    """ユーザーの契約(cold項目を含む全項目)をdata/backup/<user_id>/に書き出す。
+
+    書き出したファイルはそのままインポートできる。
+    """
+    contracts_file = Path(user_contracts_file(user_id))
+    if contracts_file.exists():
+        backup_dir = BACKUP_DIR / str(int(user_id))
         ts = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-        dst = BACKUP_DIR / f"contracts_{ts}.json"
-        shutil.copy(CONTRACTS_FILE, dst)
+        dst = backup_dir / f"contracts_{ts}.json"
+        save_data(str(dst), ContractShard(user_id).load())
         return dst
     return None
@@ -1,24 +1,22 @@
 # -*- coding: utf-8 -*-
-from pathlib import Path
-from config.settings import CARRIERS_FILE
-from utils.json_utils import load_json
+from services.json_data_store import load_data, user_carriers_file
 from models.carrier import Carrier, Plan
 
-def load_carriers():
-    data = load_json(Path(CARRIERS_FILE))
+def load_carriers(user_id):
+    data = load_data(user_carriers_file(user_id))
     carriers = []
     for d in data:
         carriers.append(Carrier.from_dict(d))
     return carriers
 
-def get_carrier_by_name(name: str):
-    for c in load_carriers():
+def get_carrier_by_name(user_id, name: str):
+    for c in load_carriers(user_id):
         if c.carrier_name == name:
             return c
     return None
 
-def get_plans_for_carrier(name: str):
-    c = get_carrier_by_name(name)
+def get_plans_for_carrier(user_id, name: str):
+    c = get_carrier_by_name(user_id, name)
     if not c:
         return []
     return c.plans
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""ダッシュボードの差分更新。
+
+クライアントは最後に受け取ったバージョン(契約のversionの最大値)を持ち、それ以降に追加・変更・削除された
+契約だけを受け取る。変更された契約は索引のバージョン順配列から二分探索で取り出し、削除や電話番号の変更で
+チェーンから外れた契約は墓標(tombstones.json)から取り出す。チェーン収支は同じ電話番号の契約すべてに
+影響するため、影響を受けた電話番号の契約をまとめて返す。
+"""
+from services.json_data_store import MAX_SAFE_VERSION, file_signature, load_tombstones, user_contracts_file, user_tombstones_file
+from services.query_engine import get_user_index
+
+def feed_signature(user_id):
+    """契約ファイルと墓標ファイルのシグネチャ。変わっていなければ差分はない。"""
+    return (file_signature(user_contracts_file(user_id)), file_signature(user_tombstones_file(user_id)))
+
+def current_version(user_id, contract_index):
+    """contract_indexを読み込んだ時点のバージョン。一覧ページに埋め込み、ライブ更新の起点にする。"""
+    tombstones = load_tombstones(user_id)
+    return max([contract_index.max_version, tombstones['horizon']] +
+               [t['version'] for t in tombstones['entries'] if _in_effect(t, contract_index)])
+
+def _in_effect(tombstone, contract_index):
+    """墓標の契約がチェーンから外れた状態をcontract_indexに反映済みか。
+
+    書き込み途中(墓標だけが先に書かれた)の場合と、同じ電話番号で登録し直された場合はFalse。
+    """
+    pos = contract_index.positions.get(tombstone['contract_id'])
+    return pos is None or contract_index.records[pos].get('phone_number') != tombstone['phone_number']
+
+def get_changes(user_id, since):
+    """sinceより後の変更を返す。
+
+    戻り値は{'version', 'reset', 'index', 'positions', 'removed'}。positionsは影響を受けた電話番号の
+    契約の索引上の位置(元の順序)、removedはチェーンから消えた契約IDのリスト。sinceが保持している
+    墓標より古い場合と、旧形式(ナノ秒)のバージョンの場合はreset=Trueだけを返すので、
+    クライアントは一覧を読み込み直す。
+    """
+    # 契約ファイルより先に墓標が書かれるので、契約を先に読めば読んだ契約に対応する墓標は必ず見える
+    index = get_user_index(user_id)
+    tombstones = load_tombstones(user_id)
+    version = index.max_version
+    if since < tombstones['horizon'] or since > MAX_SAFE_VERSION:
+        return {'version': max(version, tombstones['horizon']), 'reset': True}
+
+    records = index.records
+    changed = index.changed_since(since)
+    phones = {records[pos].get('phone_number') for pos in changed}
+    removed = []
+    for tombstone in tombstones['entries']:
+        if tombstone['version'] <= since:
+            continue
+        if not _in_effect(tombstone, index):
+            continue
+        version = max(version, tombstone['version'])
+        phones.add(tombstone['phone_number'])
+        if tombstone['contract_id'] not in index.positions:
+            removed.append(tombstone['contract_id'])
+
+    by_phone = index.hashed['phone_number']
+    positions = sorted(pos for phone in phones for pos in by_phone.get(phone, ()))
+    return {'version': max(version, since), 'reset': False, 'index': index, 'positions': positions, 'removed': removed}
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""契約のインポート・エクスポート・バックアップのジョブ関数(services.job_queue で実行する)。"""
+import json
+import os
+from services.backup_service import make_backup
+from services.group_commit import commit
+from services.job_queue import JobError
+from services.json_data_store import ContractShard, stamp_version
+from services.query_engine import QueryError, get_user_index, parse_filter
+
+# 進捗を報告し、キャンセルを確認する件数の単位
+CHUNK_SIZE = 500
+
+def export_contracts(context, user_id, filter_query):
+    """契約(cold項目を含む全項目)をJSONファイルに書き出す。filter_queryで絞り込める。"""
+    if filter_query:
+        try:
+            contracts = get_user_index(user_id).query(parse_filter(filter_query), full=True)
+        except QueryError as e:
+            raise JobError(f'絞り込み条件が不正です: {e}')
+    else:
+        contracts = ContractShard(user_id).load()
+    total = len(contracts)
+    context.progress(0, total)
+
+    path = context.path('contracts.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for start in range(0, total, CHUNK_SIZE):
+            chunk = contracts[start:start + CHUNK_SIZE]
+            f.write(',' if start else '\n')
+            f.write(',\n'.join(json.dumps(c, ensure_ascii=False, indent=4) for c in chunk))
+            context.progress(start + len(chunk), total)
+        f.write('\n]\n')
+    os.replace(tmp_path, path)
+    return {'file': path, 'filename': 'contracts.json', 'count': total}
+
+def import_contracts(context, user_id, upload_path):
+    """アップロードされたJSONファイルの契約を取り込む。契約IDが同じ契約は上書きする。"""
+    try:
+        with open(upload_path, encoding='utf-8') as f:
+            imported_data = json.load(f)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise JobError('無効なJSONファイルです。')
+    finally:
+        os.remove(upload_path)
+    if not isinstance(imported_data, list):
+        raise JobError('無効なJSONファイル形式です。トップレベルがリストである必要があります。')
+
+    total = len(imported_data)
+    valid_contracts = []
+    skipped = []
+    for i, contract in enumerate(imported_data):
+        if i % CHUNK_SIZE == 0:
+            context.progress(i, total)
+        # Basic validation for contract structure
+        if not isinstance(contract, dict) or 'contract_id' not in contract:
+            skipped.append(i)
+            continue
+        # Imported contracts always belong to the importing user's shard
+        contract['user_id'] = user_id
+        valid_contracts.append(contract)
+    context.check_cancelled()
+
+    def merge(contracts):
+        existing_contracts_dict = {c['contract_id']: c for c in contracts}
+        for contract in valid_contracts:
+            # Stamped in the writer so versions follow commit order (the change feed relies on it)
+            stamp_version(contract)
+            existing_contracts_dict[contract['contract_id']] = contract
+        contracts[:] = list(existing_contracts_dict.values())
+
+    commit(ContractShard(user_id), merge)
+    context.progress(total, total)
+    return {'imported': len(valid_contracts), 'skipped': len(skipped), 'skipped_indexes': skipped[:100]}
+
+def backup_contracts(context, user_id):
+    """services.backup_service.make_backup を実行する。作成したファイルをダウンロードできる。"""
+    context.progress(0, 1)
+    dst = make_backup(user_id)
+    context.progress(1, 1)
+    if dst is None:
+        return {'file': None, 'count': 0}
+    return {'file': str(dst), 'filename': dst.name}
@@ -1,26 +1,34 @@
 # -*- coding: utf-8 -*-
-from pathlib import Path
 from typing import List, Optional, Dict, Any
 from models.contract import Contract
-from config.settings import CONTRACTS_FILE
-from utils.json_utils import load_json, save_json
+from services.group_commit import commit
+from services.json_data_store import ContractShard, new_record_version
 from utils.date_utils import days_between, months_ceil_between
 
-def load_contracts() -> List[Contract]:
-    data = load_json(Path(CONTRACTS_FILE))
+# 各関数はuser_idのシャード(data/users/<user_id>/)だけを読み書きする。
+
+def load_contracts(user_id) -> List[Contract]:
+    data = ContractShard(user_id).load()
     return [Contract.from_dict(d) for d in data]
 
-def save_contracts(contracts: List[Contract]):
-    data = [c.to_dict() for c in contracts]
-    save_json(Path(CONTRACTS_FILE), data)
+def save_contracts(user_id, contracts: List[Contract]):
+    new_data = [c.to_dict() for c in contracts]
+
+    def replace(data):
+        data[:] = new_data
+
+    commit(ContractShard(user_id), replace)
 
 def add_contract(contract: Contract):
-    contracts = load_contracts()
-    contracts.append(contract)
-    save_contracts(contracts)
+    def add(data):
+        # Stamped in the writer so versions follow commit order (the change feed relies on it)
+        contract.version = new_record_version()
+        data.append(contract.to_dict())
+
+    commit(ContractShard(contract.user_id), add)
 
-def find_contract_by_id(cid: str) -> Optional[Contract]:
-    for c in load_contracts():
+def find_contract_by_id(user_id, cid: str) -> Optional[Contract]:
+    for c in load_contracts(user_id):
         if c.contract_id == cid:
             return c
     return None
@@ -54,14 +62,17 @@ def calculate_financials(contract: Contract) -> Dict[str, Any]:
 
 
 def update_contract(updated_contract: Contract):
-    contracts = load_contracts()
-    for i, c in enumerate(contracts):
-        if c.contract_id == updated_contract.contract_id:
-            contracts[i] = updated_contract
-            break
-    save_contracts(contracts)
-
-def delete_contract(cid: str):
-    contracts = load_contracts()
-    contracts = [c for c in contracts if c.contract_id != cid]
-    save_contracts(contracts)
+    def update(data):
+        updated_contract.version = new_record_version()
+        for i, c in enumerate(data):
+            if c.get('contract_id') == updated_contract.contract_id:
+                data[i] = updated_contract.to_dict()
+                break
+
+    commit(ContractShard(updated_contract.user_id), update)
+
+def delete_contract(user_id, cid: str):
+    def delete(data):
+        data[:] = [c for c in data if c.get('contract_id') != cid]
+
+    commit(ContractShard(user_id), delete)
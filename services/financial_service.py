@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import bisect
+from datetime import date
+from models.contract import Contract
+
+
+def _parse_iso_date(value):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def get_chain_financials(current_contract_data, all_contracts_raw):
+    """同じ電話番号を持つ契約のうち、基準契約の契約日以前に開始したものの収支を合算する。"""
+    chain_total_cost = 0
+    
+    phone_number_to_match = current_contract_data.get('phone_number')
+    if not phone_number_to_match:
+        return 0 # Cannot calculate chain financials without a phone number
+
+    # Get the contract_date of the current contract being processed
+    reference_contract_date = _parse_iso_date(current_contract_data.get('contract_date'))
+
+    # Filter contracts by phone number AND contract_date <= reference_contract_date
+    # Only include contracts that started on or before the current contract's date
+    filtered_contracts = []
+    for c in all_contracts_raw:
+        if c.get('phone_number') == phone_number_to_match:
+            contract_date_obj = _parse_iso_date(c.get('contract_date'))
+            
+            # Include if contract_date is valid and <= reference_contract_date, or if reference_contract_date is invalid/missing
+            if contract_date_obj and reference_contract_date and contract_date_obj <= reference_contract_date:
+                filtered_contracts.append(c)
+            elif not reference_contract_date: # If reference_contract_date is invalid/missing, include all contracts with matching phone number
+                filtered_contracts.append(c)
+
+    # Sort related contracts by contract_date and then scheduled_termination_date
+    # None dates should be handled gracefully, e.g., by placing them at the end
+    def get_sort_key(contract):
+        contract_date_obj = _parse_iso_date(contract.get('contract_date'))
+        scheduled_termination_date_obj = _parse_iso_date(contract.get('scheduled_termination_date'))
+        return (contract_date_obj if contract_date_obj else date.max,
+                scheduled_termination_date_obj if scheduled_termination_date_obj else date.max)
+
+    filtered_contracts.sort(key=get_sort_key)
+
+    # Calculate total cost for all related contracts
+    for contract_data in filtered_contracts:
+        total_cost = Contract.from_dict(contract_data).calculate_financials()['total_cost']
+        # 収支が計算できない契約は無視して合算を続行する
+        if total_cost is not None:
+            chain_total_cost += total_cost
+            
+    return chain_total_cost
+
+
+def chain_balances(contracts_raw, costs=None):
+    """全契約について get_chain_financials(c, contracts_raw) と同じ値をまとめて求める。
+
+    電話番号ごとに契約日順の累積和を作り、各契約は二分探索で引くため O(n log n)。
+    costs には契約ごとの収支(calculate_financials()['total_cost'])を同じ順で渡せる。
+    """
+    if costs is None:
+        costs = [Contract.from_dict(c).calculate_financials()['total_cost'] for c in contracts_raw]
+    dates = [_parse_iso_date(c.get('contract_date')) for c in contracts_raw]
+
+    chains = {}
+    for i, c in enumerate(contracts_raw):
+        if c.get('phone_number'):
+            chains.setdefault(c['phone_number'], []).append(i)
+    # phone -> (契約日の昇順リスト, 同じ順の累積収支, 契約日が不正なものを含む全体の合計)
+    ledgers = {}
+    for phone_number, members in chains.items():
+        dated = sorted((dates[i], costs[i] or 0) for i in members if dates[i])
+        prefix = [0]
+        for _, cost in dated:
+            prefix.append(prefix[-1] + cost)
+        ledgers[phone_number] = ([d for d, _ in dated], prefix, sum(costs[i] or 0 for i in members))
+
+    balances = []
+    for i, c in enumerate(contracts_raw):
+        ledger = ledgers.get(c.get('phone_number')) if c.get('phone_number') else None
+        if ledger is None:
+            balances.append(0)
+        elif dates[i] is None:
+            balances.append(ledger[2])
+        else:
+            balances.append(ledger[1][bisect.bisect_right(ledger[0], dates[i])])
+    return balances
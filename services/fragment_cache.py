@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""レンダリング済みHTML断片のキャッシュ。
+
+契約一覧の各行(<tr>)を(user_id, contract_id)ごとに一つだけ保持する。保存時のバージョンキー
+(契約のバージョン, チェーンのバージョン)が一致しない場合はミスとなり、再レンダリングした行で
+置き換えられるため、契約やチェーンが変わった行だけが作り直される。
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+
+def chain_versions_by_phone(contracts):
+    """電話番号ごとに、チェーンに属する契約の(contract_id, version)から作ったバージョンを返す。
+
+    契約の追加・削除・編集のいずれでも値が変わる。
+    """
+    members = {}
+    for c in contracts:
+        members.setdefault(c.get('phone_number'), []).append((c.get('contract_id') or '', c.get('version') or 0))
+    return {phone: hash(tuple(sorted(pairs))) for phone, pairs in members.items()}
+
+
+class FragmentCache:
+    """件数とメモリ量の上限を持つLRUキャッシュ。"""
+
+    def __init__(self, max_entries=20000, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (user_id, contract_id) -> (version_key, html, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, contract_id, version_key):
+        key = (user_id, contract_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version_key:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, contract_id, version_key, html):
+        key = (user_id, contract_id)
+        size = sys.getsizeof(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (version_key, html, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[2]
+                self.evictions += 1
+
+    def discard(self, user_id, contract_id):
+        with self._lock:
+            old = self._entries.pop((user_id, contract_id), None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""グループコミット方式の書き込みスレッド。
+
+各リクエストはファイルへの変更を関数(mutation)として投入し、Futureで完了を待つ。
+書き込み先(target)はJSONファイルのパスか、load()/save()/lock()を持つオブジェクト(ContractShardなど)。
+書き込みスレッドは短い時間窓(window_ms)か件数(max_batch)の上限まで変更を集め、
+ファイルごとに一度だけ読み込み、すべての変更を順に適用してから一度だけ永続化(fsync)する。
+Futureは永続化が完了した後に解決されるため、応答した時点でデータはディスク上にある。
+
+書き込みスレッドはプロセスごとにあるため、読み込みから永続化まではファイルのロック
+(services.json_data_store.locked_file、プロセス間はflock)を保持し、他のワーカープロセスの
+書き込みを上書きしないようにする。JSONとして読めないファイルには書き込まず、そのバッチの
+Futureをすべて失敗させる(空のリストとして扱うと保存時にデータが消えるため)。
+
+mutationは書き込みスレッドで実行されるため、requestやcurrent_userを参照してはならない。
+mutationが例外を送出した場合はそのFutureだけが失敗する。リストを変更する前に検証を済ませること。
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from services.json_data_store import load_data, locked_file, save_data
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_MS = 2
+DEFAULT_MAX_BATCH = 256
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+
+    def __init__(self, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH):
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.mutations = 0
+
+    def start(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            # A thread started before fork does not exist in the child; start a new one there
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """投入済みの変更をすべて書き込んでからスレッドを止める。"""
+        thread = self._thread
+        if thread is None or not thread.is_alive() or self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def submit(self, target, mutation):
+        """mutation(data)をtargetの内容に適用する。戻り値をresultに持つFutureを返す。"""
+        self.start()
+        future = Future()
+        self._queue.put((target, mutation, future))
+        return future
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.window_ms / 1000
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, stopping = self._collect()
+            if batch:
+                self._commit(batch)
+            if stopping:
+                return
+
+    def _commit(self, batch):
+        by_target = {}
+        for target, mutation, future in batch:
+            by_target.setdefault(target, (target, []))[1].append((mutation, future))
+
+        for target, items in by_target.values():
+            if isinstance(target, str):
+                load, save = (lambda: load_data(target, strict=True)), (lambda data: save_data(target, data))
+                lock = lambda: locked_file(target)
+            else:
+                load, save, lock = target.load, target.save, target.lock
+            outcomes = []
+            try:
+                with lock():
+                    data = load()
+                    for mutation, future in items:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        try:
+                            outcomes.append((future, True, mutation(data)))
+                        except Exception as e:
+                            outcomes.append((future, False, e))
+                    if any(ok for _, ok, _ in outcomes):
+                        save(data)
+            except Exception as e:
+                logger.exception('Group commit to %s failed', target)
+                for _, future in items:
+                    if future.done():
+                        continue
+                    if future.running() or future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+                continue
+            for future, ok, value in outcomes:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+        self.batches += 1
+        self.mutations += len(batch)
+
+
+_writer = GroupCommitWriter()
+
+def configure(window_ms=None, max_batch=None):
+    if window_ms is not None:
+        _writer.window_ms = window_ms
+    if max_batch is not None:
+        _writer.max_batch = max_batch
+
+def get_writer():
+    return _writer
+
+def commit(target, mutation, timeout=None):
+    """mutationを投入し、永続化されるまで待ってその戻り値を返す。"""
+    return _writer.submit(target, mutation).result(timeout)
+
+atexit.register(_writer.stop, 5)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""重い処理(インポート・エクスポート・バックアップ)をリクエストの外で実行するジョブキュー。
+
+ジョブはプロセスごとのスレッドプールで実行し、状態はdata/jobs.jsonのジョブ表に保存する。
+ジョブ表への書き込みはすべてグループコミット(services.group_commit)を通し、読み込みから保存まで
+プロセス間のファイルロックを保持する。そのため、どのワーカープロセスからでも進捗の確認や
+キャンセルの要求ができ、別のプロセスの進捗の書き込みがキャンセル要求や完了状態を上書きすることはない。
+
+ジョブ関数は fn(context, *args) の形で、context.progress(done, total) で進捗を報告する。
+キャンセルは協調的で、キャンセルが要求されていればprogress()やcheck_cancelled()が
+JobCancelledを送出する。関数の戻り値(dict)がジョブの結果になり、'file'を含めば
+/api/jobs/<id>/result からダウンロードできる。
+
+状態: queued → running → succeeded / failed / cancelled。実行中のプロセスが終了した
+ジョブは、次回の起動時(services.startup)か参照時にinterruptedになる。
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from services.group_commit import commit
+from services.json_data_store import JOBS_FILE, job_dir, load_data
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 32
+# ジョブ表に残す完了済みジョブの数。古いものから作業ファイルごと削除する
+JOB_HISTORY = 200
+# 進捗をジョブ表に書き込む最短間隔(秒)。キャンセル要求もこの間隔で確認する
+PROGRESS_INTERVAL = 0.5
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobError(Exception):
+    """ジョブを失敗させる、利用者に見せてよいエラー。"""
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+_process_token = (None, None)
+
+def _owner():
+    """このプロセスを表す値。fork後の子プロセスでは作り直す。"""
+    global _process_token
+    if _process_token[0] != os.getpid():
+        _process_token = (os.getpid(), uuid.uuid4().hex)
+    return {'pid': _process_token[0], 'token': _process_token[1]}
+
+def _owner_alive(owner):
+    if not owner:
+        return False
+    if owner['pid'] == os.getpid():
+        return owner['token'] == _owner()['token']
+    try:
+        os.kill(owner['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _discard_job_files(job_id):
+    """登録できなかったジョブの作業ファイル(登録前に保存したインポートのアップロードなど)を削除する。
+
+    ジョブ表にないジョブのディレクトリは、古いジョブの整理でも削除されないため。
+    """
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+def _find(jobs, job_id):
+    return next((job for job in jobs if job['id'] == job_id), None)
+
+def _update_job(job_id, **fields):
+    """ジョブ表の1件を更新し、更新後の内容を返す。"""
+    def update(jobs):
+        job = _find(jobs, job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        return dict(job)
+    return commit(JOBS_FILE, update)
+
+
+class JobContext:
+    """ジョブ関数に渡す、進捗報告とキャンセル確認の窓口。"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._cancel = threading.Event()
+        self._last_persist = 0.0
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def progress(self, done, total=None):
+        """進捗を報告する。ジョブ表への書き込みはPROGRESS_INTERVALごとにまとめる。"""
+        now = time.monotonic()
+        if now - self._last_persist >= PROGRESS_INTERVAL or (total is not None and done >= total):
+            self._last_persist = now
+            job = _update_job(self.job_id, progress={'done': done, 'total': total})
+            if job is None or job.get('cancel_requested'):
+                self._cancel.set()
+        self.check_cancelled()
+
+    def path(self, filename):
+        """このジョブの作業ファイルのパス。ディレクトリは作成済み。"""
+        directory = job_dir(self.job_id)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename)
+
+
+class JobQueue:
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._contexts = {}
+
+    def _get_executor(self):
+        # Pool threads do not survive fork; each worker process builds its own pool
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+            self._pid = os.getpid()
+            self._contexts = {}
+        return self._executor
+
+    def submit(self, user_id, kind, fn, *args, job_id=None):
+        """ジョブをジョブ表に登録して実行を予約し、登録したジョブを返す。"""
+        job_id = job_id or new_job_id()
+        context = JobContext(job_id)
+        with self._lock:
+            executor = self._get_executor()
+            full = len(self._contexts) >= self.max_pending
+            if not full:
+                self._contexts[job_id] = context
+        if full:
+            _discard_job_files(job_id)
+            raise JobQueueFull()
+        job = {
+            'id': job_id,
+            'user_id': user_id,
+            'kind': kind,
+            'status': 'queued',
+            'progress': {'done': 0, 'total': None},
+            'cancel_requested': False,
+            'owner': _owner(),
+            'created_at': _now(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+        }
+
+        def add(jobs):
+            jobs.append(job)
+            finished = [j for j in jobs if j['status'] not in ACTIVE_STATUSES]
+            dropped = {j['id'] for j in finished[:max(0, len(finished) - JOB_HISTORY)]}
+            jobs[:] = [j for j in jobs if j['id'] not in dropped]
+            return dropped
+
+        try:
+            dropped = commit(JOBS_FILE, add)
+            executor.submit(self._run, context, fn, args)
+        except Exception:
+            with self._lock:
+                self._contexts.pop(job_id, None)
+            _discard_job_files(job_id)
+            raise
+        for dropped_id in dropped:
+            shutil.rmtree(job_dir(dropped_id), ignore_errors=True)
+        return dict(job)
+
+    def _run(self, context, fn, args):
+        job_id = context.job_id
+        try:
+            job = _update_job(job_id, status='running', started_at=_now())
+            if job is None or job.get('cancel_requested'):
+                raise JobCancelled()
+            result = fn(context, *args)
+            _update_job(job_id, status='succeeded', finished_at=_now(), result=result)
+        except JobCancelled:
+            _update_job(job_id, status='cancelled', finished_at=_now())
+        except Exception as e:
+            if not isinstance(e, JobError):
+                logger.exception('Job %s failed', job_id)
+            _update_job(job_id, status='failed', finished_at=_now(), error=str(e))
+        finally:
+            with self._lock:
+                self._contexts.pop(job_id, None)
+
+    def cancel(self, job_id):
+        """同じプロセスで実行中・待機中のジョブにキャンセルを伝える。"""
+        context = self._contexts.get(job_id)
+        if context is not None:
+            context.cancel()
+
+
+_queue = JobQueue()
+
+def configure(workers=None, max_pending=None):
+    if workers is not None and workers != _queue.workers:
+        _queue.workers = workers
+        _queue._pid = None
+    if max_pending is not None:
+        _queue.max_pending = max_pending
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+def submit(user_id, kind, fn, *args, job_id=None):
+    return _queue.submit(user_id, kind, fn, *args, job_id=job_id)
+
+def _with_liveness(job):
+    """実行中のプロセスが既に終了しているジョブをinterruptedとして返す。"""
+    if job['status'] in ACTIVE_STATUSES and not _owner_alive(job.get('owner')):
+        job = dict(job, status='interrupted')
+    return job
+
+def get_job(user_id, job_id):
+    """ユーザーのジョブ。他のユーザーのジョブや存在しないジョブはNone。"""
+    job = _find(load_data(JOBS_FILE), job_id)
+    if job is None or job['user_id'] != user_id:
+        return None
+    return _with_liveness(job)
+
+def list_jobs(user_id):
+    """ユーザーのジョブを新しい順に返す。"""
+    return [_with_liveness(job) for job in reversed(load_data(JOBS_FILE)) if job['user_id'] == user_id]
+
+def cancel_job(user_id, job_id):
+    """キャンセルを要求する。待機中のジョブはすぐにcancelledになる。完了済みのジョブはそのまま返す。"""
+    def request_cancel(jobs):
+        job = _find(jobs, job_id)
+        if job is None or job['user_id'] != user_id:
+            return None
+        if job['status'] in ACTIVE_STATUSES:
+            job['cancel_requested'] = True
+            if job['status'] == 'queued' and not _owner_alive(job.get('owner')):
+                job.update(status='cancelled', finished_at=_now())
+        return dict(job)
+
+    job = commit(JOBS_FILE, request_cancel)
+    if job is not None:
+        _queue.cancel(job_id)
+    return job
+
+def recover_interrupted_jobs():
+    """実行していたプロセスが終了したジョブをinterruptedにする。更新した件数を返す。"""
+    def recover(jobs):
+        count = 0
+        for job in jobs:
+            if job['status'] in ACTIVE_STATUSES and not _owner_alive(job.get('owner')):
+                job.update(status='interrupted', finished_at=_now())
+                count += 1
+        return count
+
+    if not os.path.exists(JOBS_FILE):
+        return 0
+    count = commit(JOBS_FILE, recover)
+    if count:
+        logger.warning('%d background jobs were interrupted by a restart.', count)
+    return count
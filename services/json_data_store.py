@@ -1,41 +1,295 @@
 import json
+import logging
 import os
+import tempfile
 import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+try:
+    import fcntl
+except ImportError:  # Windows: locked_file() then only serialises threads of one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
 
 # Define file paths
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+# SIM_DATA_DIR lets tests and alternate deployments point the store at another directory
+DATA_DIR = os.environ.get('SIM_DATA_DIR') or os.path.join(BASE_DIR, 'data')
 
 USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+# Per-user shards live under data/users/<user_id>/. The monolithic files below are only read by the migration.
+USERS_DIR = os.path.join(DATA_DIR, 'users')
 CARRIERS_FILE = os.path.join(DATA_DIR, 'carriers.json')
 CONTRACTS_FILE = os.path.join(DATA_DIR, 'contracts.json')
+MIGRATED_SUFFIX = '.migrated'
+# Background job table and per-job working files (services/job_queue.py)
+JOBS_FILE = os.path.join(DATA_DIR, 'jobs.json')
+JOBS_DIR = os.path.join(DATA_DIR, 'jobs')
 
-# Ensure data directory exists
-os.makedirs(DATA_DIR, exist_ok=True)
-
-# Simple lock for file operations to prevent race conditions
-file_locks = {
-    USERS_FILE: threading.Lock(),
-    CARRIERS_FILE: threading.Lock(),
-    CONTRACTS_FILE: threading.Lock(),
-}
-
-def load_data(filepath):
-    """Loads data from a JSON file."""
-    with file_locks[filepath]:
-        if not os.path.exists(filepath):
-            return []
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return []
+# Contract fields that list views, chain math and reports never read. They are stored apart from the
+# hot records in contracts_cold.json ({contract_id: {field: value}}) and loaded only when needed.
+COLD_CONTRACT_FIELDS = ('memo', 'device_type', 'sim_id_last_5_digits')
+
+# Number of tombstones kept per user. Clients whose last seen version is older than the oldest
+# dropped tombstone have to reload instead of applying a delta.
+TOMBSTONE_LIMIT = 1000
+
+# Sidecar file that locked_file() flocks, so the data file itself can be replaced while locked
+LOCK_SUFFIX = '.lock'
+
+# Permission bits for new data files, as open() would create them (mkstemp creates 0600 files)
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+# Per-file locks serialising read-modify-write cycles between threads of this process
+file_locks = {}
+_file_locks_guard = threading.Lock()
+
+def get_file_lock(filepath):
+    """Returns the in-process lock guarding filepath, creating it on first use."""
+    lock = file_locks.get(filepath)
+    if lock is None:
+        with _file_locks_guard:
+            lock = file_locks.setdefault(filepath, threading.Lock())
+    return lock
+
+@contextmanager
+def locked_file(filepath):
+    """Holds filepath's write lock for one read-modify-write cycle.
+
+    Threads of this process wait on get_file_lock(filepath); other processes (gunicorn workers,
+    the CLI) wait on an exclusive flock of <filepath>.lock, which is released when the file is closed.
+    """
+    with get_file_lock(filepath):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath + LOCK_SUFFIX, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            yield
+
+def load_data(filepath, strict=False):
+    """Loads data from a JSON file. A missing file reads as an empty list.
+
+    A file that is not valid JSON also reads as an empty list, unless strict is set. Writers load
+    with strict=True so a damaged file raises instead of being overwritten with an empty list.
+    """
+    if not os.path.exists(filepath):
+        return []
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        if strict:
+            raise
+        logger.error("%s is not valid JSON; reading it as empty.", filepath)
+        return []
+
+def _fsync_directory(directory):
+    if os.name != 'posix':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 def save_data(filepath, data):
-    """Saves data to a JSON file."""
-    with file_locks[filepath]:
-        with open(filepath, 'w', encoding='utf-8') as f:
+    """Saves data to a JSON file, creating its directory if needed.
+
+    The data goes to a temporary file of its own in the same directory, which is fsynced and renamed
+    over the original before the directory is fsynced. Readers in any process see either the old or
+    the new file, and the data is on disk when this returns. Callers that read, modify and save
+    a file that other processes also write must hold locked_file() across the cycle.
+    """
+    directory = os.path.dirname(filepath)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(filepath) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    _fsync_directory(directory)
+
+# Versions are sent to browsers and sync clients as JSON numbers, so they must stay exact in an IEEE double
+MAX_SAFE_VERSION = 2 ** 53 - 1
+
+_last_version = 0
+_version_lock = threading.Lock()
+
+def new_record_version():
+    """Returns a new record version: a microsecond timestamp, strictly increasing within the process.
+
+    Every write to a contract stamps record['version'] so caches can tell changed records apart
+    without hashing their contents. Microseconds stay below MAX_SAFE_VERSION until the year 2255.
+    """
+    global _last_version
+    with _version_lock:
+        _last_version = max(time.time_ns() // 1000, _last_version + 1)
+        return _last_version
+
+def stamp_version(record):
+    record['version'] = new_record_version()
+    return record
+
+def user_shard_dir(user_id):
+    """Returns the directory holding one user's data files."""
+    # int() also rejects anything that could escape USERS_DIR
+    return os.path.join(USERS_DIR, str(int(user_id)))
+
+def user_contracts_file(user_id):
+    return os.path.join(user_shard_dir(user_id), 'contracts.json')
+
+def user_contracts_cold_file(user_id):
+    return os.path.join(user_shard_dir(user_id), 'contracts_cold.json')
+
+def user_carriers_file(user_id):
+    return os.path.join(user_shard_dir(user_id), 'carriers.json')
+
+def user_plan_economics_file(user_id):
+    return os.path.join(user_shard_dir(user_id), 'plan_economics.json')
+
+def user_tombstones_file(user_id):
+    return os.path.join(user_shard_dir(user_id), 'tombstones.json')
+
+def job_dir(job_id):
+    """Returns the directory holding one background job's uploads and results."""
+    if not (isinstance(job_id, str) and len(job_id) == 32 and all(ch in '0123456789abcdef' for ch in job_id)):
+        raise ValueError(f'invalid job id: {job_id!r}')
+    return os.path.join(JOBS_DIR, job_id)
+
+def list_shard_user_ids():
+    """Returns the ids of all users that have a data shard, in ascending order."""
+    if not os.path.isdir(USERS_DIR):
+        return []
+    return sorted(int(name) for name in os.listdir(USERS_DIR) if name.isdigit())
+
+def split_contract(record):
+    """Splits a full contract into its hot record and its cold fields (None if it has none)."""
+    hot = {k: v for k, v in record.items() if k not in COLD_CONTRACT_FIELDS}
+    cold = {k: record[k] for k in COLD_CONTRACT_FIELDS if record.get(k) not in (None, '')}
+    return hot, cold or None
+
+def load_cold_contract_fields(user_id, strict=False):
+    """Returns {contract_id: {cold field: value}} for one user."""
+    cold = load_data(user_contracts_cold_file(user_id), strict)
+    return cold if isinstance(cold, dict) else {}
+
+def merge_cold_fields(hot_records, cold):
+    """Returns full contracts built from hot records and the cold map. The hot records are not modified."""
+    merged = []
+    for record in hot_records:
+        full = dict.fromkeys(COLD_CONTRACT_FIELDS, '')
+        full.update(record)
+        full.update(cold.get(record.get('contract_id'), ()))
+        merged.append(full)
+    return merged
+
+def load_tombstones(user_id, strict=False):
+    """Returns {'horizon': version, 'entries': [...]} for one user.
+
+    A tombstone {'contract_id', 'phone_number', 'version'} is written whenever a contract leaves
+    a phone number's chain, either because it was deleted or because its phone number changed.
+    'horizon' is the newest version among tombstones that were dropped to stay within TOMBSTONE_LIMIT.
+    """
+    tombstones = load_data(user_tombstones_file(user_id), strict)
+    if not isinstance(tombstones, dict):
+        return {'horizon': 0, 'entries': []}
+    return tombstones
+
+def add_tombstones(user_id, entries):
+    tombstones = load_tombstones(user_id, strict=True)
+    tombstones['entries'].extend(entries)
+    overflow = len(tombstones['entries']) - TOMBSTONE_LIMIT
+    if overflow > 0:
+        dropped = tombstones['entries'][:overflow]
+        tombstones['horizon'] = max([tombstones['horizon']] + [t['version'] for t in dropped])
+        del tombstones['entries'][:overflow]
+    save_data(user_tombstones_file(user_id), tombstones)
+
+class ContractShard:
+    """One user's contracts as a group-commit target (see services.group_commit).
+
+    load() returns full contracts; save() writes the hot records and rewrites the cold file only
+    when a cold field actually changed. Shards written before the split keep their cold fields
+    in contracts.json until the next save. Contracts that left a chain between load() and save()
+    get a tombstone so the dashboard change feed can report them. lock() covers all of the shard's
+    files, so the writer holds it from load() to save().
+    """
+
+    def __init__(self, user_id):
+        self.user_id = int(user_id)
+        self._cold_snapshot = None
+        self._phone_snapshot = None
+
+    def __eq__(self, other):
+        return isinstance(other, ContractShard) and other.user_id == self.user_id
+
+    def __hash__(self):
+        return hash((ContractShard, self.user_id))
+
+    def __repr__(self):
+        return f'ContractShard({self.user_id})'
+
+    def lock(self):
+        return locked_file(user_contracts_file(self.user_id))
+
+    def load(self):
+        hot_records = load_data(user_contracts_file(self.user_id), strict=True)
+        self._cold_snapshot = load_cold_contract_fields(self.user_id, strict=True)
+        self._phone_snapshot = {r.get('contract_id'): r.get('phone_number') for r in hot_records}
+        return merge_cold_fields(hot_records, self._cold_snapshot)
+
+    def load_one(self, contract_id):
+        """Returns one full contract, or None."""
+        record = next((c for c in load_data(user_contracts_file(self.user_id)) if c.get('contract_id') == contract_id), None)
+        if record is None:
+            return None
+        return merge_cold_fields([record], load_cold_contract_fields(self.user_id))[0]
+
+    def save(self, records):
+        hot_records, cold = [], {}
+        for record in records:
+            hot, cold_fields = split_contract(record)
+            hot_records.append(hot)
+            if cold_fields and record.get('contract_id'):
+                cold[record['contract_id']] = cold_fields
+        if cold != self._cold_snapshot:
+            save_data(user_contracts_cold_file(self.user_id), cold)
+            self._cold_snapshot = cold
+        if self._phone_snapshot is not None:
+            phones = {r.get('contract_id'): r.get('phone_number') for r in hot_records}
+            left = [(cid, phone) for cid, phone in self._phone_snapshot.items()
+                    if cid is not None and (cid not in phones or phones[cid] != phone)]
+            # Written before the hot file: a reader that sees the new contracts also sees their tombstones
+            if left:
+                add_tombstones(self.user_id, [{'contract_id': cid, 'phone_number': phone, 'version': new_record_version()}
+                                              for cid, phone in left])
+            self._phone_snapshot = phones
+        save_data(user_contracts_file(self.user_id), hot_records)
+
+def file_signature(filepath):
+    """Returns (mtime_ns, size) of filepath, or None if it does not exist.
+
+    Used by in-process caches to detect that a shard was rewritten.
+    """
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
 
 def generate_next_id(data_list, id_key='id'):
     """Generates the next available integer ID for a list of dictionaries.
@@ -46,15 +300,101 @@ def generate_next_id(data_list, id_key='id'):
     return max(item.get(id_key, 0) for item in data_list) + 1
 
 def initialize_data_files():
-    """Ensures that the data JSON files exist and are initialized as empty lists if they don't."""
-    for filepath in [USERS_FILE, CARRIERS_FILE, CONTRACTS_FILE]:
-        if not os.path.exists(filepath) or not load_data(filepath):
-            save_data(filepath, [])
+    """Ensures that the users file and the shard directory exist.
+
+    Existing files are only checked for existence and are not parsed here.
+    """
+    os.makedirs(USERS_DIR, exist_ok=True)
+    if not os.path.exists(USERS_FILE):
+        save_data(USERS_FILE, [])
 
-def generate_contract_id():
-    """Generates a unique contract ID (e.g., 'C-YYYYMMDD-XXXX')."""
+def _merge_into_shards(monolithic_file, shard_file_for, key):
+    """Splits one monolithic list file into per-user shard files.
+
+    Records already present in a shard (same key) are kept as they are. Returns the number of records
+    that had no user_id and therefore could not be migrated.
+    """
+    records_by_user = {}
+    orphans = 0
+    for record in load_data(monolithic_file):
+        user_id = record.get('user_id')
+        if user_id is None:
+            orphans += 1
+            continue
+        records_by_user.setdefault(user_id, []).append(record)
+
+    for user_id, records in records_by_user.items():
+        shard_file = shard_file_for(user_id)
+        with locked_file(shard_file):
+            shard = load_data(shard_file, strict=True)
+            existing_keys = {r.get(key) for r in shard}
+            shard.extend(r for r in records if r.get(key) not in existing_keys)
+            if shard_file_for is user_contracts_file:
+                for record in shard:
+                    if record.get('version') is None:
+                        stamp_version(record)
+            save_data(shard_file, shard)
+    return orphans
+
+def migrate_to_user_shards():
+    """Moves data/contracts.json and data/carriers.json into data/users/<user_id>/.
+
+    Each monolithic file is renamed to *.migrated afterwards so the migration runs only once
+    and the original data stays available. Returns True if anything was migrated.
+    """
+    migrated = False
+    for monolithic_file, shard_file_for, key in ((CONTRACTS_FILE, user_contracts_file, 'contract_id'),
+                                                 (CARRIERS_FILE, user_carriers_file, 'id')):
+        if not os.path.exists(monolithic_file):
+            continue
+        orphans = _merge_into_shards(monolithic_file, shard_file_for, key)
+        if orphans:
+            logger.warning("%d records in %s have no user_id and were not migrated.", orphans, monolithic_file)
+        try:
+            os.replace(monolithic_file, monolithic_file + MIGRATED_SUFFIX)
+        except FileNotFoundError:
+            # Another process finished the same migration first
+            continue
+        logger.info("Migrated %s to per-user shards.", monolithic_file)
+        migrated = True
+    return migrated
+
+def _rescale_version(version):
+    return version // 1000 if isinstance(version, int) and version > MAX_SAFE_VERSION else version
+
+def rescale_record_versions():
+    """Converts nanosecond versions written by earlier releases to microseconds.
+
+    Returns the number of user shards that were rewritten. Clients still holding a nanosecond
+    version are told to reload by the change feed and get a conflict from sync.
+    """
+    rewritten = 0
+    for user_id in list_shard_user_ids():
+        contracts_file = user_contracts_file(user_id)
+        with locked_file(contracts_file):
+            contracts = load_data(contracts_file, strict=True)
+            tombstones = load_tombstones(user_id, strict=True)
+            changed = False
+            for record in contracts + tombstones['entries']:
+                if record.get('version') != _rescale_version(record.get('version')):
+                    record['version'] = _rescale_version(record['version'])
+                    changed = True
+            if tombstones['horizon'] != _rescale_version(tombstones['horizon']):
+                tombstones['horizon'] = _rescale_version(tombstones['horizon'])
+                changed = True
+            if changed:
+                # Tombstones first, as in ContractShard.save()
+                if tombstones['entries'] or tombstones['horizon']:
+                    save_data(user_tombstones_file(user_id), tombstones)
+                save_data(contracts_file, contracts)
+                rewritten += 1
+    if rewritten:
+        logger.info("Rescaled record versions to microseconds in %d user shards.", rewritten)
+    return rewritten
+
+def generate_contract_id(contracts):
+    """Generates a contract ID (e.g., 'C-YYYYMMDD-XXXX') that is unique within one user's contracts."""
     today = date.today().strftime('%Y%m%d')
-    contracts = load_data(CONTRACTS_FILE)
     # Find the highest existing sequence number for today
     max_seq = 0
     for contract in contracts:
@@ -67,5 +407,3 @@ def generate_contract_id():
             except ValueError:
                 pass
     return f'C-{today}-{max_seq + 1:04d}'
-
-from datetime import date
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""電話番号ごとの乗り換え計画(キャリア・プランの切り替え予定)の最適化。
+
+月を単位とした動的計画法で、状態は(月t, プランp, 保有月数m)。mは最低維持期間で打ち切る
+(最低維持期間を満たした後は何か月保有していても取れる行動は同じ)。各月の行動は
+「今のプランを続ける(月額を払う)」か、最低維持期間を満たしていれば「別キャリアのプランに乗り換える
+(キャッシュバック − 初期費用 − 初月費用)」のどちらか。
+
+価値表 V[t][p][m] は t月以降に得られる最大利益で、末尾の月から1回だけ計算してユーザーごとに再利用する
+(services.tenant_cache)。
+乗り換え先の価値は元の状態によらないので、月ごとに「キャリア別の最良の乗り換え先」の上位を求めておけば
+各状態はO(1)で計算でき、全体は O(月数 × (プラン数 + Σ最低維持月数)) になる。
+
+回線の現在の契約(起点)は最新契約の月額と解約予定日から作り、価値表を引きながらO(月数)で解く。
+一括モードは価値表を1回だけ作り、すべての電話番号の起点から引く。
+
+1か月は30日として数える(utils.date_utils.months_ceil_between と同じ)。計画期間の終わりに
+最低維持期間が残っている場合は、残りの月額を差し引く。
+"""
+from datetime import date, timedelta
+from models.contract import Contract
+from services import tenant_cache
+from services.carrier_service import load_carriers
+from services.group_commit import commit
+from services.json_data_store import file_signature, load_data, user_carriers_file, user_contracts_file, user_plan_economics_file
+from utils.date_utils import months_ceil_between
+
+DEFAULT_HORIZON_MONTHS = 24
+MAX_HORIZON_MONTHS = 120
+# plan_economics.json の各行が持つ、ユーザーが見込みで入力する金額
+ECONOMICS_FIELDS = ('cashback_amount', 'first_month_cost', 'monthly_cost')
+
+class OptimizerError(ValueError):
+    pass
+
+def _days_to_months(days):
+    days = days if isinstance(days, int) else 0
+    return (days - 1) // 30 + 1 if days > 0 else 0
+
+class PlanOption:
+    __slots__ = ('carrier_name', 'plan_name', 'min_months', 'monthly_cost', 'switch_gain')
+
+    def __init__(self, carrier_name, plan_name, initial_fee, minimum_maintenance_period, economics):
+        self.carrier_name = carrier_name
+        self.plan_name = plan_name
+        self.min_months = _days_to_months(minimum_maintenance_period)
+        self.monthly_cost = economics.get('monthly_cost', 0)
+        self.switch_gain = economics.get('cashback_amount', 0) - (initial_fee or 0) - economics.get('first_month_cost', 0)
+
+
+def load_plan_economics(user_id):
+    economics = load_data(user_plan_economics_file(user_id))
+    return economics if isinstance(economics, list) else []
+
+def economics_table(user_id):
+    """キャリアマスターの全プランに、入力済みの見込み金額(未入力は0)を付けた一覧。"""
+    entered = {(e['carrier_name'], e['plan_name']): e for e in load_plan_economics(user_id)}
+    rows = []
+    for carrier in load_carriers(user_id):
+        for plan in carrier.plans:
+            economics = entered.get((carrier.carrier_name, plan.plan_name), {})
+            rows.append({
+                'carrier_name': carrier.carrier_name,
+                'plan_name': plan.plan_name,
+                'initial_fee': plan.initial_fee,
+                'minimum_maintenance_period': plan.minimum_maintenance_period,
+                **{field: economics.get(field, 0) for field in ECONOMICS_FIELDS},
+            })
+    return rows
+
+def validate_economics(payload):
+    """[{"carrier_name", "plan_name", "cashback_amount", "first_month_cost", "monthly_cost"}] を検証して正規化する。"""
+    if not isinstance(payload, list):
+        raise OptimizerError('economics must be a list of objects')
+    entries = []
+    for item in payload:
+        if not isinstance(item, dict) or not item.get('carrier_name') or not item.get('plan_name'):
+            raise OptimizerError(f'each entry needs carrier_name and plan_name: {item!r}')
+        entry = {'carrier_name': str(item['carrier_name']), 'plan_name': str(item['plan_name'])}
+        for field in ECONOMICS_FIELDS:
+            value = item.get(field) or 0
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise OptimizerError(f'{field} must be an integer: {value!r}')
+            entry[field] = value
+        entries.append(entry)
+    return entries
+
+def save_plan_economics(user_id, entries):
+    def replace(economics):
+        economics[:] = entries
+    commit(user_plan_economics_file(user_id), replace)
+
+
+class PlanTable:
+    """プラン一覧と計画期間に対する価値表。"""
+
+    def __init__(self, options, horizon):
+        self.options = options
+        self.horizon = horizon
+        caps = [max(1, o.min_months) for o in options]
+        # value[t][p][m]: t月の初めにプランpをmか月保有している状態からの最大利益(m=1..cap)
+        # choice[t][p][m]: t月に乗り換える先のプラン番号、続ける場合は-1
+        self.value = [None] * (horizon + 1)
+        self.choice = [None] * horizon
+        self.value[horizon] = [[0] + [-o.monthly_cost * max(0, o.min_months - m) for m in range(1, cap + 1)]
+                               for o, cap in zip(options, caps)]
+        self._best_entries = [None] * horizon
+        for t in range(horizon - 1, -1, -1):
+            following = self.value[t + 1]
+            best = self._rank_entries([o.switch_gain + following[q][1] for q, o in enumerate(options)])
+            self._best_entries[t] = best
+            values, choices = [], []
+            for p, (o, cap) in enumerate(zip(options, caps)):
+                row_values, row_choices = [0], [-1]
+                switch = self._best_switch(t, o.carrier_name)
+                for m in range(1, cap + 1):
+                    stay = following[p][min(m + 1, cap)] - o.monthly_cost
+                    if switch and m >= o.min_months and switch[0] > stay:
+                        row_values.append(switch[0])
+                        row_choices.append(switch[1])
+                    else:
+                        row_values.append(stay)
+                        row_choices.append(-1)
+                values.append(row_values)
+                choices.append(row_choices)
+            self.value[t] = values
+            self.choice[t] = choices
+
+    def _rank_entries(self, entry_values):
+        """キャリアごとの最良の乗り換え先を価値の高い順に2件(別キャリアを除外しても1件残るように)。"""
+        best = {}
+        for q, v in enumerate(entry_values):
+            carrier_name = self.options[q].carrier_name
+            if carrier_name not in best or v > best[carrier_name][0]:
+                best[carrier_name] = (v, q, carrier_name)
+        return sorted(best.values(), key=lambda e: -e[0])[:2]
+
+    def _best_switch(self, t, carrier_name):
+        """t月に、carrier_name以外のキャリアへ乗り換えたときの(利益, プラン番号)。"""
+        for v, q, entry_carrier in self._best_entries[t]:
+            if entry_carrier != carrier_name:
+                return v, q
+        return None
+
+    def solve(self, carrier_name, monthly_cost, locked_months):
+        """現在の契約(locked_months か月は解約できない)を起点とした (最大利益, 乗り換え予定) を返す。
+
+        乗り換え予定は [(月, プラン番号)]。
+        """
+        horizon = self.horizon
+        start_value = [0] * (horizon + 1)
+        start_choice = [-1] * horizon
+        start_value[horizon] = -monthly_cost * max(0, locked_months - horizon)
+        for t in range(horizon - 1, -1, -1):
+            stay = start_value[t + 1] - monthly_cost
+            switch = self._best_switch(t, carrier_name) if t >= locked_months else None
+            if switch and switch[0] > stay:
+                start_value[t], start_choice[t] = switch[0], switch[1]
+            else:
+                start_value[t] = stay
+
+        schedule = []
+        t = next((t for t in range(horizon) if start_choice[t] >= 0), horizon)
+        if t < horizon:
+            p, m = start_choice[t], 1
+            schedule.append((t, p))
+            for t in range(t + 1, horizon):
+                q = self.choice[t][p][m]
+                if q >= 0:
+                    p, m = q, 1
+                    schedule.append((t, p))
+                else:
+                    m = min(m + 1, max(1, self.options[p].min_months))
+        return start_value[0], schedule
+
+
+def load_plan_options(user_id):
+    entered = {(e['carrier_name'], e['plan_name']): e for e in load_plan_economics(user_id)}
+    return [PlanOption(carrier.carrier_name, plan.plan_name, plan.initial_fee, plan.minimum_maintenance_period,
+                       entered.get((carrier.carrier_name, plan.plan_name), {}))
+            for carrier in load_carriers(user_id) for plan in carrier.plans]
+
+def get_plan_table(user_id, horizon):
+    """ユーザーの価値表。キャリアマスターか見込み金額が変わるまでテナントキャッシュで再利用する。"""
+    signature = (file_signature(user_carriers_file(user_id)), file_signature(user_plan_economics_file(user_id)), horizon)
+    return tenant_cache.cached(user_id, 'plan_table', signature, lambda: PlanTable(load_plan_options(user_id), horizon))
+
+def _current_contract(chain, as_of):
+    """チェーンの最新契約を起点の情報にする。契約がなければNone。"""
+    if not chain:
+        return None
+    contracts = [Contract.from_dict(c) for c in chain]
+    latest = max(contracts, key=lambda c: c.contract_date or date.min)
+    return {
+        'carrier_name': latest.carrier_name,
+        'plan_name': latest.plan_name,
+        'monthly_cost': latest.monthly_cost or 0,
+        # 解約予定日までは乗り換えない
+        'locked_months': months_ceil_between(as_of, latest.scheduled_termination_date) or 0,
+    }
+
+def _plan_chain(table, phone_number, chain, as_of):
+    current = _current_contract(chain, as_of)
+    start = current or {'carrier_name': None, 'monthly_cost': 0, 'locked_months': 0}
+    profit, switches = table.solve(start['carrier_name'], start['monthly_cost'], start['locked_months'])
+    baseline = -start['monthly_cost'] * table.horizon
+    return {
+        'phone_number': phone_number,
+        'horizon_months': table.horizon,
+        'current': current,
+        'profit': profit,
+        'baseline_profit': baseline,
+        'improvement': profit - baseline,
+        'schedule': [{
+            'month': t,
+            'date': (as_of + timedelta(days=30 * t)).isoformat(),
+            'carrier_name': table.options[p].carrier_name,
+            'plan_name': table.options[p].plan_name,
+            'switch_gain': table.options[p].switch_gain,
+        } for t, p in switches],
+    }
+
+def _check_horizon(horizon):
+    if not isinstance(horizon, int) or not 1 <= horizon <= MAX_HORIZON_MONTHS:
+        raise OptimizerError(f'horizon must be between 1 and {MAX_HORIZON_MONTHS} months')
+
+def optimize_chain(user_id, phone_number, horizon=DEFAULT_HORIZON_MONTHS, as_of=None):
+    """電話番号1つの利益最大の乗り換え予定。契約のない番号は新規契約から計画する。"""
+    _check_horizon(horizon)
+    chain = [c for c in load_data(user_contracts_file(user_id)) if c.get('phone_number') == phone_number]
+    return _plan_chain(get_plan_table(user_id, horizon), phone_number, chain, as_of or date.today())
+
+def optimize_all_chains(user_id, horizon=DEFAULT_HORIZON_MONTHS, as_of=None):
+    """ユーザーのすべての電話番号の乗り換え予定。改善額の大きい順。"""
+    _check_horizon(horizon)
+    chains = {}
+    for c in load_data(user_contracts_file(user_id)):
+        if c.get('phone_number'):
+            chains.setdefault(c['phone_number'], []).append(c)
+    table = get_plan_table(user_id, horizon)
+    as_of = as_of or date.today()
+    plans = [_plan_chain(table, phone_number, chain, as_of) for phone_number, chain in chains.items()]
+    plans.sort(key=lambda plan: (-plan['improvement'], plan['phone_number']))
+    return plans
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""契約の絞り込みクエリ。
+
+クエリは条件(Clause)のANDで、URLパラメータでは文字列、APIではJSONで指定する。
+
+    filter=carrier=ドコモ;contract_date>=2024-01-01;contract_date<=2024-12-31
+    filter=balance<0;cashback_amount>=10000;device_type?
+    [{"field": "contract_date", "op": "between", "value": ["2024-01-01", "2024-12-31"]}]
+
+演算子: = != < <= > >= between ~(部分一致) ?(値あり) !?(値なし)
+
+ContractIndexはユーザーの契約から、日付・金額には値でソートした配列(bisectで範囲検索)、
+キャリア・プランにはハッシュ索引を作る。プランナーは索引で候補数が最も少ない条件を起点に選び、
+残りの条件は索引の列配列で判定するため、契約の辞書に触れるのは最終的に一致したものだけになる。
+"""
+import bisect
+import re
+from datetime import date
+from models.contract import Contract
+from services import tenant_cache
+from services.financial_service import chain_balances
+from services.fragment_cache import chain_versions_by_phone
+from services.json_data_store import COLD_CONTRACT_FIELDS, load_cold_contract_fields, load_data, merge_cold_fields, user_contracts_file, file_signature
+
+class QueryError(ValueError):
+    pass
+
+DATE_FIELDS = ('contract_date', 'scheduled_termination_date')
+MONEY_FIELDS = ('initial_fee', 'first_month_cost', 'monthly_cost', 'cashback_amount', 'device_cost', 'device_resale_value', 'balance')
+HASH_FIELDS = ('carrier_name', 'plan_name', 'phone_number')
+TEXT_FIELDS = ('contract_id', 'carrier_name', 'plan_name', 'phone_number', 'contractor_name', 'device_type', 'sim_id_last_5_digits', 'memo')
+SORTED_FIELDS = DATE_FIELDS + MONEY_FIELDS
+FIELDS = SORTED_FIELDS + TEXT_FIELDS
+# memoなどのcold項目の列は、条件で参照されたときに初めて読み込む
+HOT_FIELDS = tuple(f for f in FIELDS if f not in COLD_CONTRACT_FIELDS)
+
+FIELD_ALIASES = {
+    'carrier': 'carrier_name',
+    'plan': 'plan_name',
+    'phone': 'phone_number',
+    'termination_date': 'scheduled_termination_date',
+}
+
+RANGE_OPS = ('<', '<=', '>', '>=', 'between')
+OPS = ('=', '!=', '~', 'present', 'absent') + RANGE_OPS
+
+_CLAUSE_RE = re.compile(r'^\s*(?P<field>[A-Za-z_]+)\s*(?P<op>>=|<=|!=|=|<|>|~)\s*(?P<value>.*?)\s*$')
+_PRESENCE_RE = re.compile(r'^\s*(?P<neg>!?)(?P<field>[A-Za-z_]+)\s*\?\s*$')
+
+
+class Clause:
+    __slots__ = ('field', 'op', 'value')
+
+    def __init__(self, field, op, value=None):
+        field = FIELD_ALIASES.get(field, field)
+        if field not in FIELDS:
+            raise QueryError(f'unknown field: {field}')
+        if op not in OPS:
+            raise QueryError(f'unknown operator: {op}')
+        if op in RANGE_OPS and field not in SORTED_FIELDS:
+            raise QueryError(f'{op} is only supported for date and amount fields, not {field}')
+        self.field = field
+        self.op = op
+        if op == 'between':
+            if not isinstance(value, (list, tuple)) or len(value) != 2:
+                raise QueryError('between needs a [low, high] pair')
+            self.value = (_coerce(field, value[0]), _coerce(field, value[1]))
+        elif op in ('present', 'absent'):
+            self.value = None
+        elif op == '~':
+            self.value = str(value).lower()
+        else:
+            self.value = _coerce(field, value)
+
+    def __repr__(self):
+        return f'Clause({self.field!r}, {self.op!r}, {self.value!r})'
+
+    def matches(self, value):
+        op = self.op
+        if op == 'present':
+            return value not in (None, '')
+        if op == 'absent':
+            return value in (None, '')
+        if op == '!=':
+            return value != self.value
+        if value is None:
+            return False
+        if op == '=':
+            return value == self.value
+        if op == '~':
+            return self.value in str(value).lower()
+        if op == '<':
+            return value < self.value
+        if op == '<=':
+            return value <= self.value
+        if op == '>':
+            return value > self.value
+        if op == '>=':
+            return value >= self.value
+        return self.value[0] <= value <= self.value[1]
+
+
+def _coerce(field, value):
+    if field in DATE_FIELDS:
+        if isinstance(value, date):
+            return value
+        try:
+            return date.fromisoformat(str(value))
+        except ValueError:
+            raise QueryError(f'{field} needs a YYYY-MM-DD date, got {value!r}')
+    if field in MONEY_FIELDS:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise QueryError(f'{field} needs an integer, got {value!r}')
+    return '' if value is None else str(value)
+
+
+def parse_filter(text):
+    """'carrier=ドコモ;balance<0' 形式の文字列をClauseのリストにする。"""
+    clauses = []
+    for part in text.split(';'):
+        if not part.strip():
+            continue
+        m = _PRESENCE_RE.match(part)
+        if m:
+            clauses.append(Clause(m.group('field'), 'absent' if m.group('neg') else 'present'))
+            continue
+        m = _CLAUSE_RE.match(part)
+        if not m:
+            raise QueryError(f'cannot parse filter: {part.strip()!r}')
+        clauses.append(Clause(m.group('field'), m.group('op'), m.group('value')))
+    return clauses
+
+
+def parse_filters(texts):
+    """URLパラメータ(複数可)をClauseのリストにする。"""
+    clauses = []
+    for text in texts:
+        clauses.extend(parse_filter(text))
+    return clauses
+
+
+def parse_json_query(payload):
+    """[{"field", "op", "value"}] または {"filters": [...]} 形式のJSONをClauseのリストにする。"""
+    if isinstance(payload, dict):
+        payload = payload.get('filters')
+    if not isinstance(payload, list):
+        raise QueryError('query must be a list of {"field", "op", "value"} objects')
+    clauses = []
+    for item in payload:
+        if not isinstance(item, dict) or 'field' not in item or 'op' not in item:
+            raise QueryError(f'invalid clause: {item!r}')
+        op = {'==': '=', 'contains': '~'}.get(item['op'], item['op'])
+        clauses.append(Clause(item['field'], op, item.get('value')))
+    return clauses
+
+
+def _record_columns(contract):
+    values = {field: getattr(contract, field) for field in HOT_FIELDS if field != 'balance'}
+    values['balance'] = contract.calculate_financials()['total_cost']
+    return values
+
+
+class ContractIndex:
+    """ユーザーの契約(hotレコード)に対する列配列と二次索引。契約リストが変わったら作り直す。
+
+    一覧の描画にも使うため、型付きの契約(contracts)、チェーン収支(chain_balances)、
+    電話番号ごとのチェーンのバージョン(chain_versions)もレコードと同じ順で持つ。
+
+    cold_loaderは{contract_id: {cold項目: 値}}を返す関数で、cold項目を参照する条件や
+    full=Trueの問い合わせで初めて呼ばれる。
+    """
+
+    def __init__(self, records, cold_loader=None):
+        self.records = records
+        self._cold_loader = cold_loader
+        self._cold = None
+        self.contracts = [Contract.from_dict(r) for r in records]
+        rows = [_record_columns(c) for c in self.contracts]
+        self.columns = {field: [row[field] for row in rows] for field in HOT_FIELDS}
+        # field -> (sorted values, positions in the same order)
+        self.sorted = {}
+        for field in SORTED_FIELDS:
+            pairs = sorted((v, pos) for pos, v in enumerate(self.columns[field]) if v is not None)
+            self.sorted[field] = ([v for v, _ in pairs], [pos for _, pos in pairs])
+        self.hashed = {}
+        for field in HASH_FIELDS:
+            buckets = {}
+            for pos, v in enumerate(self.columns[field]):
+                buckets.setdefault(v, []).append(pos)
+            self.hashed[field] = buckets
+        self.positions = {r.get('contract_id'): pos for pos, r in enumerate(records)}
+        self.chain_balances = chain_balances(records, self.columns['balance'])
+        self.chain_versions = chain_versions_by_phone(records)
+        pairs = sorted((r.get('version') or 0, pos) for pos, r in enumerate(records))
+        self._versions = ([v for v, _ in pairs], [pos for _, pos in pairs])
+
+    def __len__(self):
+        return len(self.records)
+
+    def cold_fields(self):
+        if self._cold is None:
+            self._cold = self._cold_loader() if self._cold_loader else {}
+        return self._cold
+
+    def column(self, field):
+        column = self.columns.get(field)
+        if column is None:
+            # Shards written before the hot/cold split still carry cold fields in the hot record
+            cold = self.cold_fields()
+            column = [cold.get(r.get('contract_id'), {}).get(field, r.get(field)) for r in self.records]
+            self.columns[field] = column
+        return column
+
+    @property
+    def max_version(self):
+        keys = self._versions[0]
+        return keys[-1] if keys else 0
+
+    def changed_since(self, version):
+        """versionより後に書き込まれた契約の位置(バージョン順)。"""
+        keys, positions = self._versions
+        return positions[bisect.bisect_right(keys, version):]
+
+    def matching(self, clauses, positions):
+        """positionsのうち条件をすべて満たすものを返す。"""
+        checks = [(self.column(c.field), c.matches) for c in clauses]
+        return [pos for pos in positions if all(match(column[pos]) for column, match in checks)]
+
+    def _range_bounds(self, field, clauses):
+        """同じ項目の範囲条件をまとめ、ソート済み配列上の[start, end)を返す。"""
+        keys, _ = self.sorted[field]
+        start, end = 0, len(keys)
+        for clause in clauses:
+            op, value = clause.op, clause.value
+            if op == 'between':
+                start = max(start, bisect.bisect_left(keys, value[0]))
+                end = min(end, bisect.bisect_right(keys, value[1]))
+            elif op == '=':
+                start = max(start, bisect.bisect_left(keys, value))
+                end = min(end, bisect.bisect_right(keys, value))
+            elif op == '>':
+                start = max(start, bisect.bisect_right(keys, value))
+            elif op == '>=':
+                start = max(start, bisect.bisect_left(keys, value))
+            elif op == '<':
+                end = min(end, bisect.bisect_left(keys, value))
+            elif op == '<=':
+                end = min(end, bisect.bisect_right(keys, value))
+        return start, max(start, end)
+
+    def plan(self, clauses):
+        """索引で候補を絞れる条件ごとに(件数, 取り出し関数, 使った条件)を作り、件数の少ない順に返す。"""
+        candidates = []
+        ranges = {}
+        for clause in clauses:
+            if clause.field in SORTED_FIELDS and clause.op in RANGE_OPS + ('=',):
+                ranges.setdefault(clause.field, []).append(clause)
+            elif clause.field in HASH_FIELDS and clause.op == '=':
+                positions = self.hashed[clause.field].get(clause.value, [])
+                candidates.append((len(positions), (lambda p=positions: p), [clause]))
+        for field, field_clauses in ranges.items():
+            start, end = self._range_bounds(field, field_clauses)
+            positions = self.sorted[field][1]
+            candidates.append((end - start, (lambda p=positions, s=start, e=end: p[s:e]), field_clauses))
+        candidates.sort(key=lambda c: c[0])
+        return candidates
+
+    def query_positions(self, clauses):
+        """条件をすべて満たす契約の位置を昇順で返す。"""
+        if not clauses:
+            return list(range(len(self.records)))
+        candidates = self.plan(clauses)
+        if candidates:
+            _, fetch, used = candidates[0]
+            positions = fetch()
+            remaining = [c for c in clauses if all(c is not u for u in used)]
+        else:
+            positions = range(len(self.records))
+            remaining = clauses
+        matched = self.matching(remaining, positions)
+        matched.sort()
+        return matched
+
+    def query(self, clauses, full=False):
+        """条件をすべて満たす契約を元の順序で返す。full=Trueならcold項目を含めた契約を返す。"""
+        records = [self.records[pos] for pos in self.query_positions(clauses)]
+        return merge_cold_fields(records, self.cold_fields()) if full else records
+
+
+def get_user_index(user_id):
+    """ユーザーのContractIndex。シャードファイルが変わるまでテナントキャッシュで再利用する。"""
+    contracts_file = user_contracts_file(user_id)
+    signature = file_signature(contracts_file)
+
+    def build():
+        return ContractIndex(load_data(contracts_file) if signature else [], lambda: load_cold_contract_fields(user_id))
+
+    return tenant_cache.cached(user_id, 'contracts', signature, build)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""ユーザー単位のレポート。cli.pyからプロセスプールで並列に実行される。
+
+各関数はuser_idのシャードだけを読み、行(dict)のリストを返す。
+"""
+from datetime import date
+from models.contract import Contract
+from services.financial_service import get_chain_financials
+from services.json_data_store import load_data, user_contracts_file
+from services.plan_optimizer import optimize_all_chains
+
+MONEY_FIELDS = ('initial_fee', 'first_month_cost', 'monthly_cost', 'cashback_amount', 'device_cost', 'device_resale_value')
+
+def _group_by_phone(contracts_raw):
+    chains = {}
+    for c in contracts_raw:
+        if c.get('phone_number'):
+            chains.setdefault(c['phone_number'], []).append(c)
+    return chains
+
+def profit_report(user_id):
+    """ユーザーごとの収支の合計。収支が計算できない契約は件数だけ数える。"""
+    contracts_raw = load_data(user_contracts_file(user_id))
+    total = 0
+    uncalculated = 0
+    for contract_data in contracts_raw:
+        total_cost = Contract.from_dict(contract_data).calculate_financials()['total_cost']
+        if total_cost is None:
+            uncalculated += 1
+        else:
+            total += total_cost
+    return [{
+        'user_id': user_id,
+        'contracts': len(contracts_raw),
+        'phone_numbers': len(_group_by_phone(contracts_raw)),
+        'total_balance': total,
+        'uncalculated': uncalculated,
+    }]
+
+def chain_report(user_id):
+    """電話番号ごとのチェーンの要約。総収支は最後に開始した契約を基準にget_chain_financialsで求める。"""
+    rows = []
+    for phone_number, chain in sorted(_group_by_phone(load_data(user_contracts_file(user_id))).items()):
+        contracts = [Contract.from_dict(c) for c in chain]
+        start_dates = [c.contract_date for c in contracts if c.contract_date]
+        end_dates = [c.scheduled_termination_date for c in contracts if c.scheduled_termination_date]
+        latest_index = max(range(len(chain)), key=lambda i: contracts[i].contract_date or date.min)
+        rows.append({
+            'user_id': user_id,
+            'phone_number': phone_number,
+            'contracts': len(chain),
+            'carriers': ' > '.join(c.carrier_name or '-' for c in sorted(contracts, key=lambda c: c.contract_date or date.max)),
+            'first_contract_date': min(start_dates).isoformat() if start_dates else None,
+            'last_termination_date': max(end_dates).isoformat() if end_dates else None,
+            'chain_total_balance': get_chain_financials(chain[latest_index], chain),
+        })
+    return rows
+
+def plan_report(user_id):
+    """電話番号ごとの利益最大の乗り換え予定(services.plan_optimizer の一括モード)。"""
+    rows = []
+    for plan in optimize_all_chains(user_id):
+        next_switch = plan['schedule'][0] if plan['schedule'] else None
+        rows.append({
+            'user_id': user_id,
+            'phone_number': plan['phone_number'],
+            'current_carrier': plan['current']['carrier_name'] if plan['current'] else None,
+            'profit': plan['profit'],
+            'improvement': plan['improvement'],
+            'switches': len(plan['schedule']),
+            'next_switch_date': next_switch['date'] if next_switch else None,
+            'next_carrier': next_switch['carrier_name'] if next_switch else None,
+            'next_plan': next_switch['plan_name'] if next_switch else None,
+        })
+    return rows
+
+def consistency_check(user_id):
+    """シャード内のデータの不整合を1件1行で返す。"""
+    issues = []
+
+    def issue(contract_id, problem):
+        issues.append({'user_id': user_id, 'contract_id': contract_id, 'problem': problem})
+
+    seen = set()
+    for c in load_data(user_contracts_file(user_id)):
+        contract_id = c.get('contract_id')
+        if not contract_id:
+            issue(None, 'contract_idがありません')
+        elif contract_id in seen:
+            issue(contract_id, 'contract_idが重複しています')
+        seen.add(contract_id)
+        if c.get('user_id') != user_id:
+            issue(contract_id, f"user_id {c.get('user_id')!r} がシャードと一致しません")
+        if not c.get('phone_number'):
+            issue(contract_id, 'phone_numberがありません')
+        contract = Contract.from_dict(c)
+        for field in ('contract_date', 'scheduled_termination_date'):
+            if c.get(field) and getattr(contract, field) is None:
+                issue(contract_id, f'{field} {c.get(field)!r} が日付として不正です')
+        if contract.contract_date and contract.scheduled_termination_date and contract.scheduled_termination_date < contract.contract_date:
+            issue(contract_id, '解約予定日が契約日より前です')
+        for field in MONEY_FIELDS:
+            value = c.get(field)
+            if value is not None and not isinstance(value, int):
+                issue(contract_id, f'{field} {value!r} が整数ではありません')
+    return issues
+
+REPORTS = {
+    'profit': profit_report,
+    'chains': chain_report,
+    'plans': plan_report,
+    'check': consistency_check,
+}
+
+def run_report(name, user_id):
+    """プロセスプールのワーカーから呼ばれる入口。(user_id, rows)を返す。"""
+    return user_id, REPORTS[name](user_id)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""アプリケーションの初回起動処理。
+
+データファイルの確認とデフォルトキャリアの投入は、import時やcreate_app()では行わず、
+ensure_initialized()の初回呼び出し時に一度だけ実行する。
+"""
+import logging
+import threading
+from services.job_queue import recover_interrupted_jobs
+from services.json_data_store import load_data, save_data, USERS_FILE, user_carriers_file, generate_next_id, initialize_data_files, migrate_to_user_shards, rescale_record_versions
+
+logger = logging.getLogger(__name__)
+
+_initialized = False
+_init_lock = threading.Lock()
+
+# ユーザーが最初に登録されたときに投入するキャリアとプラン
+DEFAULT_CARRIERS = [
+    ('ドコモ', [('ギガホ プレミア', 3300), ('ahamo', 0)]),
+    ('au', [('使い放題MAX 5G', 3300), ('povo2.0', 0)]),
+    ('ソフトバンク', [('メリハリ無制限+', 3300), ('LINEMO', 0)]),
+    ('楽天モバイル', [('Rakuten最強プラン', 0)]),
+]
+
+def add_default_carrier_data():
+    """最初のユーザーにキャリアが一件もなければ、デフォルトのキャリアとプランを追加する。
+
+    追加した場合はTrueを返す。
+    """
+    users = load_data(USERS_FILE)
+    if not users:
+        logger.info("No users found. Please register a user first.")
+        return False
+
+    default_user_id = users[0]['id']
+    carriers_file = user_carriers_file(default_user_id)
+    carriers = load_data(carriers_file)
+
+    # Check if default carriers already exist for this user
+    if carriers:
+        return False
+
+    for carrier_name, plan_defs in DEFAULT_CARRIERS:
+        plans = []
+        for plan_name, initial_fee in plan_defs:
+            plans.append({'id': generate_next_id(plans), 'plan_name': plan_name, 'initial_fee': initial_fee, 'minimum_maintenance_period': 0})
+        carriers.append({'id': generate_next_id(carriers), 'carrier_name': carrier_name, 'user_id': default_user_id, 'plans': plans})
+
+    save_data(carriers_file, carriers)
+    logger.info("Added %d default carriers for user %s.", len(DEFAULT_CARRIERS), default_user_id)
+    return True
+
+def migrate_data_files():
+    """保存形式の移行(一括ファイルのユーザー別シャードへの分割と、旧形式のバージョンの変換)。
+
+    Webアプリの初回起動時と、シャードを直接読むレポートCLIの起動時に実行する。移行済みなら何もしない。
+    """
+    migrate_to_user_shards()
+    rescale_record_versions()
+
+def ensure_initialized():
+    """データファイルの初期化、ユーザー別シャードへの移行、旧形式のバージョンの変換、
+    デフォルトデータの投入、中断されたジョブの整理を一度だけ実行する。
+
+    2回目以降の呼び出しはフラグの確認のみで返る。gunicornの--preloadでは
+    マスタープロセスで実行しておくことで、fork後のワーカーは結果を引き継ぐ。
+    """
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        initialize_data_files()
+        migrate_data_files()
+        add_default_carrier_data()
+        recover_interrupted_jobs()
+        _initialized = True
+
+def reset_initialized():
+    """テスト用: 次回のensure_initialized()で初期化処理を再実行させる。"""
+    global _initialized
+    with _init_lock:
+        _initialized = False
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""インポート/エクスポートの差分同期。
+
+契約はcontract_idのハッシュで NUM_BUCKETS 個のバケットに分けられる。サーバーは
+契約ごとの内容ハッシュ、バケットごとのダイジェスト、それらをまとめたルートダイジェストを公開する。
+クライアントは次の手順で同期する。
+
+1. 手元のルートダイジェストを送り、一致すれば同期は不要(応答は数十バイト)。
+2. 一致しなければバケットダイジェストを比較し、異なるバケットの契約ハッシュだけを取得する。
+3. 内容が異なる契約だけを、取得時のバージョン(base_version)付きで送信する。
+   サーバー側のバージョンが進んでいればその契約は競合として返され、適用されない。
+
+ハッシュはクライアントとサーバーで同じ計算(record_hash)を使う。
+"""
+import hashlib
+import json
+from datetime import date
+from models.contract import DATE_FIELDS
+from services import tenant_cache
+from services.group_commit import commit
+from services.json_data_store import ContractShard, user_contracts_file, user_contracts_cold_file, stamp_version, file_signature
+
+NUM_BUCKETS = 64
+# サーバーが管理する項目はハッシュに含めない
+UNHASHED_FIELDS = ('version', 'user_id')
+# pushされた契約の型の検証に使う項目(金額は整数かnull、文字列項目は文字列かnull)
+MONEY_FIELDS = ('initial_fee', 'first_month_cost', 'monthly_cost', 'cashback_amount', 'device_cost', 'device_resale_value')
+TEXT_FIELDS = ('contract_id', 'phone_number', 'contractor_name', 'carrier_name', 'plan_name',
+               'sim_id_last_5_digits', 'device_type', 'memo')
+
+
+class SyncError(ValueError):
+    """pushされた契約が不正。contract_idは問題のあった契約のID。"""
+
+    def __init__(self, message, contract_id=None):
+        super().__init__(message)
+        self.contract_id = contract_id
+
+def validate_record(record):
+    """pushされた契約が一覧や収支計算で読める形かを確認し、そうでなければSyncErrorを送出する。"""
+    contract_id = record.get('contract_id')
+    if not isinstance(contract_id, str) or not contract_id:
+        raise SyncError(f'contract_id must be a non-empty string: {contract_id!r}')
+    for field in TEXT_FIELDS:
+        value = record.get(field)
+        if value is not None and not isinstance(value, str):
+            raise SyncError(f'{field} must be a string or null: {value!r}', contract_id)
+    for field in MONEY_FIELDS:
+        value = record.get(field)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            raise SyncError(f'{field} must be an integer or null: {value!r}', contract_id)
+    for field in DATE_FIELDS:
+        value = record.get(field)
+        if value in (None, ''):
+            continue
+        try:
+            date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise SyncError(f'{field} must be an ISO date (YYYY-MM-DD) or empty: {value!r}', contract_id)
+
+def _hexdigest(data):
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+def record_hash(record):
+    """契約の内容ハッシュ。キー順や空白に依存せず、空の項目と項目なしを区別しない。"""
+    content = {k: v for k, v in record.items() if k not in UNHASHED_FIELDS and v not in (None, '')}
+    return _hexdigest(json.dumps(content, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+
+def bucket_of(contract_id):
+    return int.from_bytes(hashlib.blake2b(str(contract_id).encode('utf-8'), digest_size=2).digest(), 'big') % NUM_BUCKETS
+
+def build_digest(records):
+    """契約のリストから同期用のダイジェストを作る。
+
+    {'root': str, 'buckets': [str] * NUM_BUCKETS, 'records': {bucket: {contract_id: {'hash', 'version'}}}}
+    """
+    buckets = {}
+    for record in records:
+        contract_id = record.get('contract_id')
+        if not contract_id:
+            continue
+        buckets.setdefault(bucket_of(contract_id), {})[contract_id] = {
+            'hash': record_hash(record),
+            'version': record.get('version'),
+        }
+    bucket_digests = []
+    for bucket in range(NUM_BUCKETS):
+        entries = buckets.get(bucket, {})
+        payload = ';'.join(f'{cid}={entries[cid]["hash"]}' for cid in sorted(entries))
+        bucket_digests.append(_hexdigest(payload.encode('utf-8')))
+    return {
+        'root': _hexdigest(''.join(bucket_digests).encode('ascii')),
+        'buckets': bucket_digests,
+        'records': buckets,
+    }
+
+def changed_buckets(local_buckets, remote_buckets):
+    """ダイジェストが異なるバケット番号のリスト。"""
+    return [i for i, (a, b) in enumerate(zip(local_buckets, remote_buckets)) if a != b]
+
+def get_user_digest(user_id):
+    """ユーザーのシャードのダイジェスト。シャードファイルが変わるまでテナントキャッシュで再利用する。"""
+    # ハッシュは全項目から計算するため、hot/coldどちらのファイルが変わっても作り直す
+    signature = (file_signature(user_contracts_file(user_id)), file_signature(user_contracts_cold_file(user_id)))
+    return tenant_cache.cached(user_id, 'sync_digest', signature, lambda: build_digest(ContractShard(user_id).load()))
+
+def get_records(user_id, contract_ids):
+    wanted = set(contract_ids)
+    return [c for c in ContractShard(user_id).load() if c.get('contract_id') in wanted]
+
+def apply_changes(user_id, upserts, deletes):
+    """クライアントの変更を競合検出付きでシャードに適用する。
+
+    upserts: [{'record': dict, 'base_version': int|None}]  新規契約はbase_version=None
+    deletes: [{'contract_id': str, 'base_version': int}]
+    サーバー側の契約のバージョンがbase_versionと異なる場合は適用せず、conflictsに現在の契約を返す。
+    不正な契約が1件でもあれば何も書き込まずにSyncErrorを送出する。
+    """
+    for change in upserts:
+        validate_record(change['record'])
+    applied, conflicts = [], []
+
+    def apply(contracts):
+        # 書き込みスレッドで実行されるため、確認と適用の間に他の書き込みが割り込まない
+        by_id = {c.get('contract_id'): i for i, c in enumerate(contracts)}
+        removed = set()
+
+        def conflict(contract_id, current):
+            conflicts.append({
+                'contract_id': contract_id,
+                'server_version': current.get('version') if current else None,
+                'server_record': current,
+            })
+
+        for change in upserts:
+            record = dict(change['record'])
+            contract_id = record['contract_id']
+            index = by_id.get(contract_id)
+            current = contracts[index] if index is not None else None
+            if (current.get('version') if current else None) != change.get('base_version'):
+                conflict(contract_id, current)
+                continue
+            record['user_id'] = user_id
+            stamp_version(record)
+            if index is None:
+                by_id[contract_id] = len(contracts)
+                contracts.append(record)
+            else:
+                contracts[index] = record
+            applied.append({'contract_id': contract_id, 'version': record['version']})
+
+        for change in deletes:
+            contract_id = change['contract_id']
+            index = by_id.get(contract_id)
+            current = contracts[index] if index is not None else None
+            if current is None or current.get('version') != change.get('base_version'):
+                conflict(contract_id, current)
+                continue
+            removed.add(contract_id)
+            applied.append({'contract_id': contract_id, 'version': None})
+
+        if removed:
+            contracts[:] = [c for c in contracts if c.get('contract_id') not in removed]
+
+    commit(ContractShard(user_id), apply)
+    return applied, conflicts
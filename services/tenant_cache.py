@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""ユーザー(テナント)ごとの作業データのキャッシュ。
+
+アクティブなユーザーの派生データ(契約の索引と型付きレコード・チェーン収支の累積和、同期用ダイジェスト、
+契約フォーム用のキャリア一覧、乗り換え計画の価値表)を、部品(part)ごとに元ファイルのシグネチャと
+一緒に保持する。シグネチャが変わった部品は次に参照されたときに作り直す。
+
+プロセスごとのメモリ量の上限(max_bytes)を超えたら、最も長く参照されていないユーザーの作業データを
+まとめて捨てる。メモリ量は estimate_size() による見積もりで、大きなコンテナは標本から推定する。
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+# これより要素の多いコンテナは、等間隔に取り出したこの数の要素から全体の大きさを推定する
+SAMPLE_SIZE = 32
+
+_SCALARS = (str, bytes, int, float, bool, type(None))
+
+
+def estimate_size(obj, _seen=None):
+    """objとそこから辿れるオブジェクトのおおよそのバイト数。"""
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, _SCALARS) or callable(obj):
+        return size
+    if isinstance(obj, dict):
+        items = list(obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = list(obj)
+    elif hasattr(obj, '__dict__'):
+        return size + estimate_size(vars(obj), seen)
+    elif hasattr(type(obj), '__slots__'):
+        return size + sum(estimate_size(getattr(obj, name, None), seen) for name in type(obj).__slots__)
+    else:
+        return size
+    if len(items) > SAMPLE_SIZE:
+        step = len(items) / SAMPLE_SIZE
+        sample = [items[int(i * step)] for i in range(SAMPLE_SIZE)]
+        return size + int(sum(estimate_size(item, seen) for item in sample) * len(items) / SAMPLE_SIZE)
+    return size + sum(estimate_size(item, seen) for item in items)
+
+
+class TenantCache:
+    """ユーザー単位でLRU追い出しを行う、メモリ量上限付きのキャッシュ。"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._tenants = OrderedDict()  # user_id -> {part: (signature, value, size)}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, part, signature, build):
+        """user_idのpartを返す。signatureが保存時と異なるか追い出されていれば、build()で作り直す。"""
+        with self._lock:
+            entry = self._tenants.get(user_id, {}).get(part)
+            if entry is not None and entry[0] == signature:
+                self._tenants.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = build()
+        self._put(user_id, part, signature, value, estimate_size(value))
+        return value
+
+    def _put(self, user_id, part, signature, value, size):
+        with self._lock:
+            parts = self._tenants.setdefault(user_id, {})
+            self._tenants.move_to_end(user_id)
+            old = parts.pop(part, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if size > self.max_bytes:
+                # Too large to keep; served uncached until it shrinks or the budget grows
+                if not parts:
+                    del self._tenants[user_id]
+                return
+            parts[part] = (signature, value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._tenants) > 1:
+                evicted_id, evicted = self._tenants.popitem(last=False)
+                self._bytes -= sum(entry[2] for entry in evicted.values())
+                self.evictions += 1
+            if self._bytes > self.max_bytes:
+                # Only this tenant is left: keep the part just built and drop the others
+                for other in [p for p in parts if p != part]:
+                    self._bytes -= parts.pop(other)[2]
+
+    def discard(self, user_id):
+        with self._lock:
+            parts = self._tenants.pop(user_id, None)
+            if parts:
+                self._bytes -= sum(entry[2] for entry in parts.values())
+
+    def clear(self):
+        with self._lock:
+            self._tenants.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            parts = {}
+            for tenant_parts in self._tenants.values():
+                for part, entry in tenant_parts.items():
+                    count, size = parts.get(part, (0, 0))
+                    parts[part] = (count + 1, size + entry[2])
+            return {
+                'tenants': len(self._tenants),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'parts': {part: {'entries': count, 'bytes': size} for part, (count, size) in sorted(parts.items())},
+            }
+
+
+_cache = TenantCache()
+
+def configure(max_bytes=None):
+    if max_bytes is not None:
+        with _cache._lock:
+            _cache.max_bytes = max_bytes
+
+def get_cache():
+    return _cache
+
+def cached(user_id, part, signature, build):
+    """services から使う入口。TenantCache.get と同じ。"""
+    return _cache.get(user_id, part, signature, build)
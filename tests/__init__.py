@@ -1,2 +1,23 @@
 # -*- coding: utf-8 -*-
 # __init__.py
+import atexit
+import os
+import shutil
+import tempfile
+import unittest
+
+# Keep tests away from the real data/ directory. Must run before services.json_data_store is imported,
+# and overrides an exported SIM_DATA_DIR so the tests never clear a live data directory.
+TEST_DATA_DIR = tempfile.mkdtemp(prefix='sim-test-data-')
+os.environ['SIM_DATA_DIR'] = TEST_DATA_DIR
+atexit.register(shutil.rmtree, TEST_DATA_DIR, True)
+
+
+class DataDirTestCase(unittest.TestCase):
+    """空のテスト用dataディレクトリから始めるテスト。"""
+
+    def setUp(self):
+        from services.json_data_store import DATA_DIR
+        if DATA_DIR != TEST_DATA_DIR:
+            raise RuntimeError(f'services.json_data_store uses {DATA_DIR}, not the test data directory; refusing to clear it')
+        shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
@@ -1,6 +1,8 @@
+import random
 import unittest
 from datetime import date
-from app import Contract # Import Contract from app.py
+from models.contract import Contract
+from services.financial_service import chain_balances, get_chain_financials
 
 class TestFinancialCalculations(unittest.TestCase):
 
@@ -90,5 +92,23 @@ class TestFinancialCalculations(unittest.TestCase):
         self.assertEqual(financials['contract_duration_months'], 2)
         self.assertEqual(financials['total_cost'], -8300)
 
+class TestChainBalances(unittest.TestCase):
+
+    def test_prefix_sums_match_per_contract_calculation(self):
+        """累積和によるチェーン収支がget_chain_financialsと一致することをテストする"""
+        rng = random.Random(3)
+        dates = ['2024-01-01', '2024-01-01', '2024-03-15', '2024-06-30', '2024/07/01', '', None]
+        contracts = [{
+            'contract_id': f'c{i}',
+            'phone_number': rng.choice(['090', '080', '070', '']),
+            'contract_date': rng.choice(dates),
+            'scheduled_termination_date': rng.choice(dates),
+            'initial_fee': rng.choice([0, 3300]),
+            'monthly_cost': rng.choice([0, 990, 2000]),
+            'cashback_amount': rng.choice([0, 10000]),
+        } for i in range(60)]
+        expected = [get_chain_financials(c, contracts) for c in contracts]
+        self.assertEqual(chain_balances(contracts), expected)
+
 if __name__ == '__main__':
     unittest.main()
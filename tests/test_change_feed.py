@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+from models.contract import Contract
+from services import change_feed, contract_service, json_data_store
+from services.group_commit import commit
+from services.json_data_store import ContractShard, load_tombstones, save_data, user_contracts_file
+from tests import DataDirTestCase
+
+def _ids(changes):
+    records = changes['index'].records
+    return [records[pos]['contract_id'] for pos in changes['positions']]
+
+class TestChangeFeed(DataDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        save_data(user_contracts_file(1), [
+            {'contract_id': 'a', 'phone_number': '090', 'user_id': 1, 'version': 1},
+            {'contract_id': 'b', 'phone_number': '090', 'user_id': 1, 'version': 2},
+            {'contract_id': 'c', 'phone_number': '080', 'user_id': 1, 'version': 3},
+        ])
+
+    def test_changed_contract_returns_its_whole_chain(self):
+        """変更された契約と同じ電話番号の契約がまとめて返ることをテストする"""
+        changes = change_feed.get_changes(1, 1)
+        self.assertFalse(changes['reset'])
+        self.assertEqual(changes['version'], 3)
+        self.assertEqual(_ids(changes), ['a', 'b', 'c'])
+        self.assertEqual(_ids(change_feed.get_changes(1, 2)), ['c'])
+        self.assertEqual(_ids(change_feed.get_changes(1, 3)), [])
+
+    def test_delete_and_phone_change_leave_tombstones(self):
+        """削除と電話番号の変更がチェーンから外れた契約として返ることをテストする"""
+        def edit(contracts):
+            contracts[:] = [c for c in contracts if c['contract_id'] != 'a']
+            contracts[-1].update(phone_number='090', version=json_data_store.new_record_version())
+
+        commit(ContractShard(1), edit)
+        changes = change_feed.get_changes(1, 3)
+        self.assertEqual(changes['removed'], ['a'])
+        self.assertEqual(_ids(changes), ['b', 'c'])
+        self.assertEqual(changes['version'], change_feed.current_version(1, changes['index']))
+        self.assertEqual(_ids(change_feed.get_changes(1, changes['version'])), [])
+
+    def test_client_older_than_retained_tombstones_resets(self):
+        """保持している墓標より古いバージョンからの差分が読み込み直しになることをテストする"""
+        with mock.patch.object(json_data_store, 'TOMBSTONE_LIMIT', 1):
+            commit(ContractShard(1), lambda contracts: contracts.pop(0))
+            commit(ContractShard(1), lambda contracts: contracts.pop(0))
+        horizon = load_tombstones(1)['horizon']
+        self.assertTrue(change_feed.get_changes(1, 3)['reset'])
+        self.assertEqual(change_feed.get_changes(1, horizon)['removed'], ['b'])
+
+    def test_versions_are_assigned_in_commit_order(self):
+        """呼び出しから書き込みまでの間に他の書き込みがあっても、追加・更新が差分に含まれることをテストする"""
+        cursors = []
+        real_commit = contract_service.commit
+
+        def commit_after_other_write(target, mutation):
+            # Another write commits here and a dashboard takes its version as the cursor
+            cursors.append(json_data_store.new_record_version())
+            return real_commit(target, mutation)
+
+        contract = Contract.from_dict({'contract_id': 'd', 'phone_number': '070', 'user_id': 1})
+        with mock.patch.object(contract_service, 'commit', commit_after_other_write):
+            contract_service.add_contract(contract)
+            self.assertEqual(_ids(change_feed.get_changes(1, cursors[-1])), ['d'])
+            contract.memo = 'updated'
+            contract_service.update_contract(contract)
+            self.assertEqual(_ids(change_feed.get_changes(1, cursors[-1])), ['d'])
+
+if __name__ == '__main__':
+    unittest.main()
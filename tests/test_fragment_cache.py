@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import unittest
+from services.fragment_cache import FragmentCache, chain_versions_by_phone
+
+class TestFragmentCache(unittest.TestCase):
+
+    def test_hit_requires_same_version_key(self):
+        """バージョンキーが一致する場合だけヒットすることをテストする"""
+        cache = FragmentCache()
+        cache.put(1, 'c1', (1, 10), '<tr>a</tr>')
+        self.assertEqual(cache.get(1, 'c1', (1, 10)), '<tr>a</tr>')
+        self.assertIsNone(cache.get(1, 'c1', (2, 10)))
+        self.assertIsNone(cache.get(1, 'c1', (1, 11)))
+        self.assertIsNone(cache.get(2, 'c1', (1, 10)))
+
+    def test_put_replaces_previous_version(self):
+        """同じ契約の新しい行が古い行を置き換えることをテストする"""
+        cache = FragmentCache()
+        cache.put(1, 'c1', (1, 10), '<tr>a</tr>')
+        cache.put(1, 'c1', (2, 10), '<tr>b</tr>')
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertEqual(cache.get(1, 'c1', (2, 10)), '<tr>b</tr>')
+
+    def test_lru_eviction_by_entries_and_bytes(self):
+        """件数とメモリ量の上限を超えると最も古い行が追い出されることをテストする"""
+        cache = FragmentCache(max_entries=2)
+        cache.put(1, 'a', 0, 'a')
+        cache.put(1, 'b', 0, 'b')
+        cache.get(1, 'a', 0)
+        cache.put(1, 'c', 0, 'c')
+        self.assertIsNone(cache.get(1, 'b', 0))
+        self.assertEqual(cache.get(1, 'a', 0), 'a')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        row = 'x' * 1000
+        cache = FragmentCache(max_bytes=2500)
+        for cid in ('a', 'b', 'c'):
+            cache.put(1, cid, 0, row)
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertLessEqual(cache.stats()['bytes'], 2500)
+
+    def test_discard(self):
+        cache = FragmentCache()
+        cache.put(1, 'c1', 0, 'a')
+        cache.discard(1, 'c1')
+        self.assertIsNone(cache.get(1, 'c1', 0))
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_chain_version_changes_with_any_member(self):
+        """チェーン内の契約の追加・編集・削除でチェーンのバージョンが変わることをテストする"""
+        contracts = [
+            {'contract_id': 'a', 'phone_number': '090', 'version': 1},
+            {'contract_id': 'b', 'phone_number': '090', 'version': 2},
+            {'contract_id': 'c', 'phone_number': '080', 'version': 3},
+        ]
+        before = chain_versions_by_phone(contracts)
+        edited = chain_versions_by_phone([dict(contracts[0], version=4)] + contracts[1:])
+        removed = chain_versions_by_phone(contracts[1:])
+        self.assertNotEqual(before['090'], edited['090'])
+        self.assertNotEqual(before['090'], removed['090'])
+        self.assertEqual(before['080'], edited['080'])
+
+if __name__ == '__main__':
+    unittest.main()
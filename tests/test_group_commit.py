@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from services.json_data_store import load_data, save_data, USERS_DIR
+from services.group_commit import GroupCommitWriter
+from tests import DataDirTestCase
+
+class TestGroupCommitWriter(DataDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(USERS_DIR, '1', 'contracts.json')
+        self.writer = GroupCommitWriter(window_ms=20, max_batch=1000)
+
+    def tearDown(self):
+        self.writer.stop()
+
+    def test_concurrent_mutations_are_coalesced(self):
+        """同時に投入された変更がまとめて一度に書き込まれることをテストする"""
+        barrier = threading.Barrier(20)
+        results = []
+
+        def worker(i):
+            barrier.wait()
+            results.append(self.writer.submit(self.path, lambda data: data.append({'contract_id': str(i)}) or i).result())
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sorted(results), list(range(20)))
+        self.assertEqual(len(load_data(self.path)), 20)
+        self.assertEqual(self.writer.mutations, 20)
+        self.assertLess(self.writer.batches, 20)
+
+    def test_failed_mutation_does_not_affect_others(self):
+        """失敗した変更のFutureだけが例外になることをテストする"""
+        def fail(data):
+            raise ValueError('bad')
+
+        bad = self.writer.submit(self.path, fail)
+        good = self.writer.submit(self.path, lambda data: data.append({'contract_id': 'a'}))
+        with self.assertRaises(ValueError):
+            bad.result(5)
+        good.result(5)
+        self.assertEqual(load_data(self.path), [{'contract_id': 'a'}])
+
+    def test_result_is_available_after_persisting(self):
+        """Futureの解決時点でファイルに書き込まれていることをテストする"""
+        self.writer.submit(self.path, lambda data: data.append(1)).result(5)
+        self.assertEqual(load_data(self.path), [1])
+
+    def test_processes_do_not_lose_each_others_writes(self):
+        """複数のプロセスが同じファイルに書き込んでも変更が失われず、読み手が途中の状態を見ないことをテストする"""
+        code = ("import sys; from services.group_commit import commit\n"
+                "for i in range(100): commit(sys.argv[1], lambda data: data.append({'p': sys.argv[2], 'i': i}))")
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        writers = [subprocess.Popen([sys.executable, '-c', code, self.path, str(p)], cwd=project_dir) for p in range(2)]
+        while any(w.poll() is None for w in writers):
+            load_data(self.path, strict=True)
+        self.assertEqual([w.returncode for w in writers], [0, 0])
+        data = load_data(self.path)
+        self.assertEqual(sorted((d['p'], d['i']) for d in data), [(p, i) for p in '01' for i in range(100)])
+        self.assertEqual([name for name in os.listdir(os.path.dirname(self.path)) if name.endswith('.tmp')], [])
+
+    def test_damaged_file_is_not_overwritten(self):
+        """JSONとして読めないファイルに書き込まず、変更が失敗することをテストする"""
+        save_data(self.path, [])
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('[{"contract_id": "a"')
+        with self.assertRaises(json.JSONDecodeError):
+            self.writer.submit(self.path, lambda data: data.append(1)).result(5)
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '[{"contract_id": "a"')
+
+if __name__ == '__main__':
+    unittest.main()
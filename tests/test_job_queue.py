@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+from services import change_feed, contract_jobs, job_queue, json_data_store
+from services.json_data_store import JOBS_FILE, job_dir, load_data, save_data
+from tests import DataDirTestCase
+
+def _wait(job_id, user_id=1):
+    for _ in range(200):
+        job = job_queue.get_job(user_id, job_id)
+        if job['status'] not in job_queue.ACTIVE_STATUSES:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+class TestJobQueue(DataDirTestCase):
+
+    def test_job_reports_progress_and_result(self):
+        """ジョブの進捗と結果がジョブ表に保存されることをテストする"""
+        def work(context, n):
+            for i in range(n):
+                context.progress(i + 1, n)
+            return {'count': n}
+
+        job = job_queue.submit(1, 'test', work, 3)
+        self.assertEqual(job['status'], 'queued')
+        done = _wait(job['id'])
+        self.assertEqual(done['status'], 'succeeded')
+        self.assertEqual(done['progress'], {'done': 3, 'total': 3})
+        self.assertEqual(done['result'], {'count': 3})
+        self.assertIsNone(job_queue.get_job(2, job['id']))
+
+    def test_running_job_stops_at_next_progress_after_cancel(self):
+        """実行中のジョブがキャンセル要求後の進捗報告で止まることをテストする"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def work(context):
+            started.set()
+            release.wait(5)
+            context.progress(1, 2)
+            return {'finished': True}
+
+        job = job_queue.submit(1, 'test', work)
+        started.wait(5)
+        self.assertTrue(job_queue.cancel_job(1, job['id'])['cancel_requested'])
+        release.set()
+        self.assertEqual(_wait(job['id'])['status'], 'cancelled')
+
+    def test_failed_job_keeps_error_message(self):
+        def work(context):
+            raise job_queue.JobError('壊れています')
+
+        self.assertEqual(_wait(job_queue.submit(1, 'test', work)['id'])['error'], '壊れています')
+
+    def test_jobs_of_exited_processes_are_interrupted(self):
+        """終了したプロセスのジョブが起動時にinterruptedになることをテストする"""
+        stale_owner = {'pid': 1, 'token': 'old'}
+        save_data(JOBS_FILE, [
+            {'id': 'a' * 32, 'user_id': 1, 'status': 'running', 'owner': stale_owner},
+            {'id': 'b' * 32, 'user_id': 1, 'status': 'succeeded', 'owner': stale_owner},
+        ])
+        with mock.patch.object(job_queue, '_owner_alive', return_value=False):
+            self.assertEqual(job_queue.recover_interrupted_jobs(), 1)
+        self.assertEqual([j['status'] for j in load_data(JOBS_FILE)], ['interrupted', 'succeeded'])
+
+    def test_cancel_from_another_process_is_not_overwritten(self):
+        """別のプロセスのキャンセル要求が、実行中のプロセスの進捗の書き込みで消えないことをテストする"""
+        code = ("import time; from services import job_queue\n"
+                "job_queue.PROGRESS_INTERVAL = 0\n"
+                "def work(context):\n"
+                "    while True:\n"
+                "        context.progress(1)\n"
+                "job = job_queue.submit(1, 'test', work)\n"
+                "print(job['id'], flush=True)\n"
+                "while job_queue.get_job(1, job['id'])['status'] in job_queue.ACTIVE_STATUSES:\n"
+                "    time.sleep(0.01)\n")
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        runner = subprocess.Popen([sys.executable, '-c', code], cwd=project_dir, stdout=subprocess.PIPE, text=True)
+        try:
+            job_id = runner.stdout.readline().strip()
+            while job_queue.get_job(1, job_id)['status'] != 'running':
+                time.sleep(0.01)
+            self.assertTrue(job_queue.cancel_job(1, job_id)['cancel_requested'])
+            self.assertEqual(runner.wait(10), 0)
+        finally:
+            runner.kill()
+        self.assertEqual(job_queue.get_job(1, job_id)['status'], 'cancelled')
+
+    def test_full_queue_removes_files_stored_before_submitting(self):
+        """キューが満杯で登録できなかったジョブのアップロードが残らないことをテストする"""
+        job_id = job_queue.new_job_id()
+        os.makedirs(job_dir(job_id))
+        with open(os.path.join(job_dir(job_id), 'upload.json'), 'w') as f:
+            f.write('[]')
+        with mock.patch.object(job_queue._queue, 'max_pending', 0):
+            with self.assertRaises(job_queue.JobQueueFull):
+                job_queue.submit(1, 'import', lambda context: None, job_id=job_id)
+        self.assertFalse(os.path.exists(job_dir(job_id)))
+        self.assertIsNone(job_queue.get_job(1, job_id))
+
+    def test_imported_contracts_appear_in_change_feed(self):
+        """インポート中に他の書き込みがあっても、取り込んだ契約が差分に含まれることをテストする"""
+        cursors = []
+        real_commit = contract_jobs.commit
+
+        def commit_after_other_write(target, mutation):
+            # Another write commits here and a dashboard takes its version as the cursor
+            cursors.append(json_data_store.new_record_version())
+            return real_commit(target, mutation)
+
+        upload_path = os.path.join(json_data_store.DATA_DIR, 'upload.json')
+        save_data(upload_path, [{'contract_id': 'I1', 'phone_number': '070'}])
+        with mock.patch.object(contract_jobs, 'commit', commit_after_other_write):
+            job = job_queue.submit(1, 'import', contract_jobs.import_contracts, 1, upload_path)
+            self.assertEqual(_wait(job['id'])['status'], 'succeeded')
+        changes = change_feed.get_changes(1, cursors[0])
+        self.assertEqual([changes['index'].records[pos]['contract_id'] for pos in changes['positions']], ['I1'])
+
+if __name__ == '__main__':
+    unittest.main()
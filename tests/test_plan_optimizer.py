@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import itertools
+import random
+import unittest
+from datetime import date
+from services import plan_optimizer
+from services.json_data_store import save_data, user_carriers_file, user_contracts_file
+from services.plan_optimizer import PlanOption, PlanTable
+from tests import DataDirTestCase
+
+def _brute_force(options, horizon, carrier_name, monthly_cost, locked_months):
+    """すべての乗り換え予定を列挙して最大利益を求める。"""
+    def run(t, p, held):
+        # p is None while still on the starting contract
+        if t == horizon:
+            if p is None:
+                return -monthly_cost * max(0, locked_months - horizon)
+            return -options[p].monthly_cost * max(0, options[p].min_months - held)
+        current_carrier = carrier_name if p is None else options[p].carrier_name
+        cost = monthly_cost if p is None else options[p].monthly_cost
+        best = run(t + 1, p, held + 1) - cost
+        can_switch = t >= locked_months if p is None else held >= options[p].min_months
+        if can_switch:
+            for q, o in enumerate(options):
+                if o.carrier_name != current_carrier:
+                    best = max(best, o.switch_gain + run(t + 1, q, 1))
+        return best
+    return run(0, None, 0)
+
+class TestPlanOptimizer(DataDirTestCase):
+
+    def test_matches_exhaustive_search(self):
+        """動的計画法の結果が全探索と一致することをテストする"""
+        rng = random.Random(7)
+        for _ in range(20):
+            options = [PlanOption(carrier, f'{carrier}-{i}', rng.choice((0, 3300)), rng.choice((0, 30, 65, 95)),
+                                  {'cashback_amount': rng.choice((0, 5000, 15000)), 'monthly_cost': rng.choice((0, 990, 3000))})
+                       for carrier, i in itertools.product('ABC', range(2))]
+            horizon = rng.randint(1, 7)
+            table = PlanTable(options, horizon)
+            start = (rng.choice('AZ'), rng.choice((0, 2000)), rng.randint(0, 3))
+            profit, schedule = table.solve(*start)
+            self.assertEqual(profit, _brute_force(options, horizon, *start))
+
+    def test_schedule_respects_minimum_period_and_carrier_change(self):
+        """乗り換え予定が最低維持期間を守り、同じキャリアへの乗り換えを含まないことをテストする"""
+        options = [PlanOption('A', 'a', 0, 60, {'cashback_amount': 10000}),
+                   PlanOption('B', 'b', 0, 60, {'cashback_amount': 10000})]
+        profit, schedule = PlanTable(options, 7).solve('A', 0, 1)
+        self.assertEqual(profit, 30000)
+        self.assertEqual([options[p].carrier_name for _, p in schedule], ['B', 'A', 'B'])
+        months = [t for t, _ in schedule]
+        self.assertGreaterEqual(months[0], 1)
+        self.assertTrue(all(b - a >= 2 for a, b in zip(months, months[1:])))
+
+    def test_batch_and_single_chain_agree(self):
+        """一括モードと電話番号ごとの最適化の結果が一致することをテストする"""
+        save_data(user_carriers_file(1), [
+            {'id': 1, 'carrier_name': 'A', 'user_id': 1, 'plans': [{'plan_name': 'a', 'initial_fee': 3300, 'minimum_maintenance_period': 90}]},
+            {'id': 2, 'carrier_name': 'B', 'user_id': 1, 'plans': [{'plan_name': 'b', 'initial_fee': 0, 'minimum_maintenance_period': 30}]},
+        ])
+        plan_optimizer.save_plan_economics(1, plan_optimizer.validate_economics([
+            {'carrier_name': 'A', 'plan_name': 'a', 'cashback_amount': 20000, 'monthly_cost': 1000},
+            {'carrier_name': 'B', 'plan_name': 'b', 'monthly_cost': 500},
+        ]))
+        save_data(user_contracts_file(1), [
+            {'contract_id': 'x', 'phone_number': '090', 'carrier_name': 'B', 'monthly_cost': 500,
+             'contract_date': '2025-01-01', 'scheduled_termination_date': '2025-03-01'},
+            {'contract_id': 'y', 'phone_number': '080', 'carrier_name': 'A', 'monthly_cost': 2000,
+             'contract_date': '2024-06-01', 'scheduled_termination_date': '2024-12-01'},
+        ])
+        as_of = date(2025, 1, 15)
+        plans = plan_optimizer.optimize_all_chains(1, 12, as_of)
+        self.assertEqual(sorted(p['phone_number'] for p in plans), ['080', '090'])
+        for plan in plans:
+            self.assertEqual(plan, plan_optimizer.optimize_chain(1, plan['phone_number'], 12, as_of))
+        by_phone = {p['phone_number']: p for p in plans}
+        self.assertEqual(by_phone['090']['current']['locked_months'], 2)
+        self.assertEqual(by_phone['090']['schedule'][0]['month'], 2)
+        self.assertEqual(by_phone['090']['schedule'][0]['carrier_name'], 'A')
+
+    def test_invalid_economics_and_horizon_are_rejected(self):
+        with self.assertRaises(plan_optimizer.OptimizerError):
+            plan_optimizer.validate_economics([{'carrier_name': 'A', 'plan_name': 'a', 'monthly_cost': '1000'}])
+        with self.assertRaises(plan_optimizer.OptimizerError):
+            plan_optimizer.optimize_all_chains(1, plan_optimizer.MAX_HORIZON_MONTHS + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+from datetime import date
+from services.query_engine import ContractIndex, Clause, QueryError, parse_filter, parse_json_query
+
+def _contracts(n):
+    rng = random.Random(7)
+    contracts = []
+    for i in range(n):
+        month = rng.randint(1, 12)
+        contracts.append({
+            'contract_id': f'C-{i}', 'phone_number': f'090{i % 50:04d}',
+            'carrier_name': rng.choice(['ドコモ', 'au', 'ソフトバンク']), 'plan_name': rng.choice(['a', 'b']),
+            'contract_date': f'2024-{month:02d}-01', 'scheduled_termination_date': f'2025-{month:02d}-01',
+            'initial_fee': 3300, 'first_month_cost': 0, 'monthly_cost': rng.randint(0, 3000),
+            'cashback_amount': rng.choice([0, 5000, 10000, 20000]), 'device_cost': 0, 'device_resale_value': 0,
+            'device_type': rng.choice(['', 'iPhone', None]), 'memo': '', 'user_id': 1,
+        })
+    return contracts
+
+class TestQueryEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.contracts = _contracts(500)
+        self.index = ContractIndex(self.contracts)
+
+    def _scan(self, clauses):
+        return [r for pos, r in enumerate(self.contracts)
+                if all(c.matches(self.index.column(c.field)[pos]) for c in clauses)]
+
+    def test_parse_filter(self):
+        """文字列の絞り込み条件が正しく解釈されることをテストする"""
+        clauses = parse_filter('carrier=ドコモ; balance<0 ;device_type?;!memo?;contract_date>=2024-03-01')
+        self.assertEqual([(c.field, c.op) for c in clauses], [
+            ('carrier_name', '='), ('balance', '<'), ('device_type', 'present'), ('memo', 'absent'), ('contract_date', '>='),
+        ])
+        self.assertEqual(clauses[1].value, 0)
+        self.assertEqual(clauses[4].value, date(2024, 3, 1))
+
+    def test_invalid_filters(self):
+        """不正な項目・値・演算子がQueryErrorになることをテストする"""
+        for text in ('nope=1', 'balance<abc', 'contract_date>yesterday', 'carrier<ドコモ', 'carrier'):
+            with self.assertRaises(QueryError):
+                parse_filter(text)
+        with self.assertRaises(QueryError):
+            parse_json_query([{'field': 'contract_date', 'op': 'between', 'value': ['2024-01-01']}])
+
+    def test_index_matches_full_scan(self):
+        """索引を使った結果が全件走査と一致することをテストする"""
+        queries = [
+            'carrier=ドコモ',
+            'balance<0;cashback_amount>=10000',
+            'contract_date>=2024-03-01;contract_date<=2024-06-30;carrier=au',
+            'device_type?;monthly_cost>2500',
+            'plan=b;balance>-20000;carrier!=au',
+            'phone~0901',
+        ]
+        for text in queries:
+            clauses = parse_filter(text)
+            self.assertEqual(self.index.query(clauses), self._scan(clauses), text)
+        clauses = parse_json_query([{'field': 'contract_date', 'op': 'between', 'value': ['2024-02-01', '2024-04-01']}])
+        self.assertEqual(self.index.query(clauses), self._scan(clauses))
+
+    def test_planner_starts_from_most_selective_index(self):
+        """候補数が最も少ない索引が起点に選ばれることをテストする"""
+        clauses = [Clause('carrier', '=', 'ドコモ'), Clause('contract_date', 'between', ['2024-05-01', '2024-05-01'])]
+        size, _, used = self.index.plan(clauses)[0]
+        self.assertEqual(used[0].field, 'contract_date')
+        self.assertLess(size, len(self.index.hashed['carrier_name']['ドコモ']))
+
+if __name__ == '__main__':
+    unittest.main()
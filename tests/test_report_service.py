@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import unittest
+from cli import iter_results, main
+from services.json_data_store import CONTRACTS_FILE, DATA_DIR, save_data, user_contracts_file
+from services.report_service import profit_report, chain_report, consistency_check
+from tests import DataDirTestCase
+
+def _contract(contract_id, phone_number, contract_date, cashback_amount, **extra):
+    data = {
+        'contract_id': contract_id, 'phone_number': phone_number, 'user_id': 1,
+        'contract_date': contract_date, 'scheduled_termination_date': '2024-03-01',
+        'initial_fee': 0, 'first_month_cost': 0, 'monthly_cost': 0, 'cashback_amount': cashback_amount,
+        'device_cost': 0, 'device_resale_value': 0,
+    }
+    data.update(extra)
+    return data
+
+class TestReportService(DataDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        save_data(user_contracts_file(1), [
+            _contract('a', '090', '2024-01-01', 1000),
+            _contract('b', '090', '2024-02-01', 2000),
+            _contract('c', '080', None, 500),
+        ])
+
+    def test_profit_report(self):
+        """収支が計算できない契約を除いて合計されることをテストする"""
+        self.assertEqual(profit_report(1), [{
+            'user_id': 1, 'contracts': 3, 'phone_numbers': 2, 'total_balance': 3000, 'uncalculated': 1,
+        }])
+
+    def test_chain_report(self):
+        """チェーンの総収支が最後の契約を基準に合算されることをテストする"""
+        rows = {r['phone_number']: r for r in chain_report(1)}
+        self.assertEqual(rows['090']['contracts'], 2)
+        self.assertEqual(rows['090']['chain_total_balance'], 3000)
+        self.assertEqual(rows['090']['first_contract_date'], '2024-01-01')
+
+    def test_consistency_check(self):
+        """不正な日付・重複ID・ユーザー不一致が検出されることをテストする"""
+        save_data(user_contracts_file(1), [
+            _contract('a', '090', '2024-13-01', 0),
+            _contract('a', '090', '2024-01-01', 0, user_id=2),
+        ])
+        problems = [r['problem'] for r in consistency_check(1)]
+        self.assertEqual(len(problems), 3)
+        self.assertTrue(any('重複' in p for p in problems))
+
+    def test_failing_user_does_not_stop_other_users(self):
+        """集計に失敗したユーザーがあっても他のユーザーの結果が返ることをテストする"""
+        save_data(user_contracts_file(2), [_contract('x', '070', '2024-01-01', 0, user_id=2, initial_fee='3300')])
+        results = {user_id: (rows, error) for user_id, rows, error in iter_results('profit', [2, 1], 1)}
+        self.assertIsNone(results[2][0])
+        self.assertIsInstance(results[2][1], TypeError)
+        self.assertEqual(results[1][0][0]['total_balance'], 3000)
+        self.assertIsNone(results[1][1])
+
+    def test_cli_migrates_monolithic_files_before_reporting(self):
+        """シャードに移行されていないデータでも、CLIが移行してから集計することをテストする"""
+        save_data(CONTRACTS_FILE, [_contract('m', '070', '2024-01-01', 0, user_id=3, initial_fee='3300')])
+        output = os.path.join(DATA_DIR, 'check.jsonl')
+        self.assertEqual(main(['check', '--jobs', '1', '--format', 'jsonl', '--output', output, '--no-progress']), 1)
+        with open(output, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertIn('m', {r['contract_id'] for r in rows})
+        self.assertFalse(os.path.exists(CONTRACTS_FILE))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+from services.json_data_store import (load_data, save_data, DATA_DIR, CONTRACTS_FILE, CARRIERS_FILE, MIGRATED_SUFFIX,
+                                      MAX_SAFE_VERSION, user_contracts_file, user_carriers_file, list_shard_user_ids,
+                                      migrate_to_user_shards, new_record_version, rescale_record_versions, load_tombstones,
+                                      user_tombstones_file)
+from services import contract_service
+from tests import DataDirTestCase
+
+class TestUserShards(DataDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(DATA_DIR)
+
+    def test_migration_splits_by_user(self):
+        """一括ファイルがユーザー別シャードに分割されることをテストする"""
+        save_data(CONTRACTS_FILE, [
+            {'contract_id': 'a', 'user_id': 1},
+            {'contract_id': 'b', 'user_id': 2},
+            {'contract_id': 'c', 'user_id': 1},
+            {'contract_id': 'orphan'},
+        ])
+        save_data(CARRIERS_FILE, [{'id': 1, 'carrier_name': 'au', 'user_id': 2, 'plans': []}])
+
+        self.assertTrue(migrate_to_user_shards())
+
+        self.assertEqual([c['contract_id'] for c in load_data(user_contracts_file(1))], ['a', 'c'])
+        self.assertEqual([c['contract_id'] for c in load_data(user_contracts_file(2))], ['b'])
+        self.assertEqual(load_data(user_carriers_file(1)), [])
+        self.assertEqual(len(load_data(user_carriers_file(2))), 1)
+        self.assertEqual(list_shard_user_ids(), [1, 2])
+        self.assertFalse(os.path.exists(CONTRACTS_FILE))
+        self.assertTrue(os.path.exists(CONTRACTS_FILE + MIGRATED_SUFFIX))
+        self.assertFalse(migrate_to_user_shards())
+
+    def test_migration_keeps_existing_shard_records(self):
+        """シャードに既にある契約が一括ファイルの内容で上書きされないことをテストする"""
+        save_data(user_contracts_file(1), [{'contract_id': 'a', 'user_id': 1, 'memo': 'new'}])
+        save_data(CONTRACTS_FILE, [{'contract_id': 'a', 'user_id': 1, 'memo': 'old'}])
+        migrate_to_user_shards()
+        shard = load_data(user_contracts_file(1))
+        self.assertEqual([c['memo'] for c in shard], ['new'])
+        self.assertIsNotNone(shard[0]['version'])
+
+    def test_write_touches_only_own_shard(self):
+        """あるユーザーの書き込みが他ユーザーのシャードを変更しないことをテストする"""
+        save_data(user_contracts_file(2), [{'contract_id': 'b', 'user_id': 2}])
+        before = os.stat(user_contracts_file(2)).st_mtime_ns
+
+        contract_service.delete_contract(1, 'b')
+
+        self.assertEqual(os.stat(user_contracts_file(2)).st_mtime_ns, before)
+        self.assertEqual(load_data(user_contracts_file(1)), [])
+
+    def test_nanosecond_versions_are_rescaled(self):
+        """旧形式(ナノ秒)のバージョンがJSONの数値で正確に表せる範囲に変換されることをテストする"""
+        save_data(user_contracts_file(1), [{'contract_id': 'a', 'user_id': 1, 'version': 1_700_000_000_123_456_789},
+                                           {'contract_id': 'b', 'user_id': 1, 'version': 1_700_000_000_000_000}])
+        save_data(user_tombstones_file(1), {'horizon': 1_700_000_000_000_000_000,
+                                            'entries': [{'contract_id': 'c', 'phone_number': '090', 'version': 1_700_000_000_200_000_000}]})
+        self.assertEqual(rescale_record_versions(), 1)
+        self.assertEqual([c['version'] for c in load_data(user_contracts_file(1))], [1_700_000_000_123_456, 1_700_000_000_000_000])
+        self.assertEqual(load_tombstones(1), {'horizon': 1_700_000_000_000_000,
+                                              'entries': [{'contract_id': 'c', 'phone_number': '090', 'version': 1_700_000_000_200_000}]})
+        self.assertEqual(rescale_record_versions(), 0)
+        self.assertLess(1_700_000_000_123_456, new_record_version())
+        self.assertLessEqual(new_record_version(), MAX_SAFE_VERSION)
+
+    def test_shard_path_rejects_non_integer_user_id(self):
+        """ユーザーIDが整数でない場合にシャードのパスを作らないことをテストする"""
+        with self.assertRaises(ValueError):
+            user_contracts_file('../1')
+
+if __name__ == '__main__':
+    unittest.main()
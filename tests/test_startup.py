@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+from services.json_data_store import load_data, save_data, USERS_FILE, USERS_DIR, DATA_DIR, user_carriers_file
+from services.startup import ensure_initialized, reset_initialized
+from tests import DataDirTestCase
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestStartup(DataDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reset_initialized()
+
+    def tearDown(self):
+        reset_initialized()
+
+    def test_creates_missing_files_once(self):
+        """初回呼び出しでデータファイルが作成されることをテストする"""
+        ensure_initialized()
+        self.assertEqual(load_data(USERS_FILE), [])
+        self.assertTrue(os.path.isdir(USERS_DIR))
+
+    def test_seeds_default_carriers_idempotently(self):
+        """デフォルトキャリアが一度だけ追加されることをテストする"""
+        os.makedirs(DATA_DIR, exist_ok=True)
+        save_data(USERS_FILE, [{'id': 1, 'username': 'u', 'password_hash': 'x'}])
+        ensure_initialized()
+        carriers = load_data(user_carriers_file(1))
+        self.assertEqual({c['user_id'] for c in carriers}, {1})
+
+        reset_initialized()
+        ensure_initialized()
+        self.assertEqual(len(load_data(user_carriers_file(1))), len(carriers))
+
+    def test_second_call_does_not_touch_files(self):
+        """2回目以降の呼び出しがファイルにアクセスしないことをテストする"""
+        ensure_initialized()
+        shutil.rmtree(DATA_DIR)
+        ensure_initialized()
+        self.assertFalse(os.path.exists(DATA_DIR))
+
+    def test_models_import_without_flask(self):
+        """モデルと収支計算がFlaskをimportしないことをテストする"""
+        code = ("import sys, models, services.financial_service; "
+                "sys.exit(1 if any(m == 'flask' or m.startswith('flask.') for m in sys.modules) else 0)")
+        result = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_DIR)
+        self.assertEqual(result.returncode, 0)
+
+if __name__ == '__main__':
+    unittest.main()
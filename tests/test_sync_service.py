@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import unittest
+from services.json_data_store import ContractShard, load_data, save_data, user_contracts_file
+from services import sync_service
+from tests import DataDirTestCase
+
+class TestSyncService(DataDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        save_data(user_contracts_file(1), [
+            {'contract_id': 'a', 'memo': '', 'user_id': 1, 'version': 1},
+            {'contract_id': 'b', 'memo': '', 'user_id': 1, 'version': 2},
+        ])
+
+    def test_record_hash_ignores_key_order_and_server_fields(self):
+        """キー順とサーバー管理項目がハッシュに影響しないことをテストする"""
+        self.assertEqual(sync_service.record_hash({'a': 1, 'b': 2, 'version': 5}),
+                         sync_service.record_hash({'b': 2, 'a': 1, 'user_id': 9}))
+        self.assertNotEqual(sync_service.record_hash({'a': 1}), sync_service.record_hash({'a': 2}))
+        self.assertEqual(sync_service.record_hash({'a': 1, 'memo': ''}), sync_service.record_hash({'a': 1}))
+
+    def test_only_changed_bucket_differs(self):
+        """1件の変更で1バケットだけダイジェストが変わることをテストする"""
+        records = load_data(user_contracts_file(1))
+        server = sync_service.get_user_digest(1)
+        local = sync_service.build_digest([dict(records[0], memo='x'), records[1]])
+        self.assertNotEqual(local['root'], server['root'])
+        self.assertEqual(sync_service.changed_buckets(local['buckets'], server['buckets']),
+                         [sync_service.bucket_of('a')])
+
+    def test_apply_detects_version_conflicts(self):
+        """base_versionがサーバーと異なる変更が競合として拒否されることをテストする"""
+        applied, conflicts = sync_service.apply_changes(1, [
+            {'record': {'contract_id': 'a', 'memo': 'ok'}, 'base_version': 1},
+            {'record': {'contract_id': 'b', 'memo': 'stale'}, 'base_version': 1},
+            {'record': {'contract_id': 'c', 'memo': 'new'}, 'base_version': None},
+        ], [])
+        self.assertEqual([a['contract_id'] for a in applied], ['a', 'c'])
+        self.assertEqual([(c['contract_id'], c['server_version']) for c in conflicts], [('b', 2)])
+
+        memos = {c['contract_id']: c['memo'] for c in ContractShard(1).load()}
+        self.assertEqual(memos, {'a': 'ok', 'b': '', 'c': 'new'})
+
+    def test_push_rejects_malformed_record(self):
+        """型の不正な契約のpushが400になり、シャードが変わらないことをテストする"""
+        from app import create_app
+        client = create_app({'TESTING': True}).test_client()
+        client.post('/register', data={'username': 'u', 'password': 'pw', 'confirm_password': 'pw'})
+        client.post('/login', data={'username': 'u', 'password': 'pw'})
+        before = load_data(user_contracts_file(1))
+        for record in ({'contract_id': 'X1', 'initial_fee': '3300'},
+                       {'contract_id': 'X1', 'phone_number': 9012345678},
+                       {'contract_id': 'X1', 'contract_date': '2024/01/01'}):
+            response = client.post('/api/sync/push', json={'upserts': [
+                {'record': {'contract_id': 'c', 'memo': 'valid'}, 'base_version': None},
+                {'record': record, 'base_version': None},
+            ]})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()['contract_id'], 'X1')
+        self.assertEqual(load_data(user_contracts_file(1)), before)
+        self.assertEqual(client.get('/api/contracts').status_code, 200)
+
+    def test_apply_delete(self):
+        applied, conflicts = sync_service.apply_changes(1, [], [
+            {'contract_id': 'a', 'base_version': 1},
+            {'contract_id': 'b', 'base_version': 7},
+        ])
+        self.assertEqual([a['contract_id'] for a in applied], ['a'])
+        self.assertEqual([c['contract_id'] for c in load_data(user_contracts_file(1))], ['b'])
+
+if __name__ == '__main__':
+    unittest.main()
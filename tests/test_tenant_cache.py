@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import unittest
+from services.tenant_cache import TenantCache, estimate_size
+
+class TestTenantCache(unittest.TestCase):
+
+    def test_rebuilds_when_signature_changes(self):
+        """シグネチャが変わった部品だけが作り直されることをテストする"""
+        cache = TenantCache(max_bytes=1024 * 1024)
+        builds = []
+
+        def build(value):
+            builds.append(value)
+            return [value]
+
+        self.assertEqual(cache.get(1, 'contracts', 'v1', lambda: build('a')), ['a'])
+        self.assertEqual(cache.get(1, 'contracts', 'v1', lambda: build('b')), ['a'])
+        self.assertEqual(cache.get(1, 'contracts', 'v2', lambda: build('c')), ['c'])
+        self.assertEqual(builds, ['a', 'c'])
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 2))
+
+    def test_evicts_least_recently_used_tenant_over_budget(self):
+        """メモリ量の上限を超えたとき、最も長く参照されていないユーザーが追い出されることをテストする"""
+        payload = lambda: ['x' * 1000 for _ in range(10)]
+        cache = TenantCache(max_bytes=2 * estimate_size(payload()) + 1000)
+        cache.get(1, 'contracts', 's', payload)
+        cache.get(2, 'contracts', 's', payload)
+        cache.get(1, 'contracts', 's', payload)
+        cache.get(3, 'contracts', 's', payload)
+
+        stats = cache.stats()
+        self.assertEqual(stats['tenants'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+        rebuilt = []
+        cache.get(2, 'contracts', 's', lambda: rebuilt.append(2) or payload())
+        self.assertEqual(rebuilt, [2])
+
+    def test_oversized_value_is_not_kept(self):
+        cache = TenantCache(max_bytes=100)
+        self.assertEqual(cache.get(1, 'contracts', 's', lambda: ['x' * 1000]), ['x' * 1000])
+        self.assertEqual(cache.stats()['tenants'], 0)
+
+    def test_estimate_scales_with_sampled_contents(self):
+        """大きなリストの見積もりが標本から全体の大きさに拡大されることをテストする"""
+        small = [{'memo': 'x' * 100} for _ in range(10)]
+        large = [{'memo': 'x' * 100} for _ in range(1000)]
+        ratio = estimate_size(large) / estimate_size(small)
+        self.assertTrue(80 < ratio < 120, ratio)
+
+if __name__ == '__main__':
+    unittest.main()
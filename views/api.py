@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from flask import Blueprint, Response, current_app, jsonify, request, send_file, stream_with_context, url_for
+from flask_login import login_required, current_user
+from services import change_feed, job_queue, plan_optimizer, sync_service, tenant_cache
+from services.query_engine import QueryError, get_user_index, parse_filter, parse_filters, parse_json_query
+from views.contracts import matches_search, render_row_fragments
+
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+def _bad_request(message):
+    return jsonify({'error': message}), 400
+
+def _not_found(message):
+    return jsonify({'error': message}), 404
+
+def _query_response(parse, source):
+    try:
+        clauses = parse(source)
+    except QueryError as e:
+        return _bad_request(str(e))
+    contracts = get_user_index(current_user.id).query(clauses, full=True)
+    return jsonify({'count': len(contracts), 'contracts': contracts})
+
+@bp.route('/contracts')
+@login_required
+def list_contracts():
+    """?filter=carrier=ドコモ;balance<0 で絞り込んだ契約。filterは複数指定できる。"""
+    return _query_response(parse_filters, request.args.getlist('filter'))
+
+@bp.route('/contracts/query', methods=['POST'])
+@login_required
+def query_contracts():
+    """[{"field", "op", "value"}] 形式のJSONで絞り込んだ契約。"""
+    return _query_response(parse_json_query, request.get_json(silent=True))
+
+def _changes_payload(user_id, since, search_query, clauses):
+    """sinceより後の変更を、一覧ページ(search, filter)にそのまま差し込める形にする。
+
+    rowsは表示する行のHTML、removedは一覧から消す契約ID(削除されたものと条件に合わなくなったもの)、
+    chain_balancesは影響を受けた電話番号の契約ごとのチェーン収支。
+    """
+    changes = change_feed.get_changes(user_id, since)
+    if changes['reset']:
+        return {'version': changes['version'], 'reset': True}
+    contract_index = changes['index']
+    records = contract_index.records
+    positions = changes['positions']
+    visible = set(contract_index.matching(clauses, positions))
+    shown = [pos for pos in positions if pos in visible and matches_search(records[pos], search_query)]
+    shown_ids = {records[pos].get('contract_id') for pos in shown}
+    return {
+        'version': changes['version'],
+        'reset': False,
+        'rows': [{'contract_id': records[pos].get('contract_id'), 'html': html}
+                 for pos, html in zip(shown, render_row_fragments(user_id, contract_index, shown))],
+        'removed': changes['removed'] + [records[pos].get('contract_id') for pos in positions
+                                         if records[pos].get('contract_id') not in shown_ids],
+        'chain_balances': {records[pos].get('contract_id'): contract_index.chain_balances[pos] for pos in positions},
+    }
+
+def _live_request_args(since):
+    """since(なければ0)と一覧ページと同じsearch, filter。不正な値はQueryErrorにする。"""
+    try:
+        since = int(since or 0)
+    except ValueError:
+        raise QueryError('since must be a version number')
+    return since, request.args.get('search', ''), parse_filter(request.args.get('filter', ''))
+
+@bp.route('/contracts/changes')
+@login_required
+def contract_changes():
+    """?since=<version> より後に追加・変更・削除された契約の行。resetがtrueなら一覧を読み込み直す。"""
+    try:
+        since, search_query, clauses = _live_request_args(request.args.get('since'))
+    except QueryError as e:
+        return _bad_request(str(e))
+    return jsonify(_changes_payload(current_user.id, since, search_query, clauses))
+
+# Streams open in this worker process. Each one holds a request thread, so they are capped at
+# LIVE_MAX_STREAMS to leave the other threads for ordinary requests.
+_open_streams = 0
+_open_streams_lock = threading.Lock()
+
+def _acquire_stream_slot(limit):
+    global _open_streams
+    with _open_streams_lock:
+        if _open_streams >= limit:
+            return False
+        _open_streams += 1
+        return True
+
+def _release_stream_slot():
+    global _open_streams
+    with _open_streams_lock:
+        _open_streams -= 1
+
+@bp.route('/contracts/stream')
+@login_required
+def contract_stream():
+    """/contracts/changes と同じ内容をServer-Sent Eventsで送り続ける。
+
+    イベントのidはバージョンなので、再接続時にブラウザが送るLast-Event-IDから続きを送れる。
+    ストリームはLIVE_STREAM_MAX_SECONDSで閉じ、ブラウザの自動再接続でワーカーのスレッドを解放する。
+    ストリームは接続中ずっとワーカーのスレッドを1つ使うため、ワーカーごとにLIVE_MAX_STREAMS本までとし、
+    それを超える接続には503を返す。ブラウザは /contracts/changes のポーリングに切り替える。
+    """
+    try:
+        since, search_query, clauses = _live_request_args(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    except QueryError as e:
+        return _bad_request(str(e))
+    user_id = current_user.id
+    config = current_app.config
+    if not _acquire_stream_slot(config['LIVE_MAX_STREAMS']):
+        response = jsonify({'error': 'too many live streams; poll /api/contracts/changes instead'})
+        response.headers['Retry-After'] = str(config['LIVE_POLL_FALLBACK_SECONDS'])
+        return response, 503
+
+    def events():
+        nonlocal since
+        yield 'retry: 3000\n\n'
+        signature = None
+        started = last_sent = time.monotonic()
+        while time.monotonic() - started < config['LIVE_STREAM_MAX_SECONDS']:
+            current = change_feed.feed_signature(user_id)
+            if current != signature:
+                signature = current
+                payload = _changes_payload(user_id, since, search_query, clauses)
+                since = payload['version']
+                if payload['reset'] or payload['rows'] or payload['removed']:
+                    yield f'id: {since}\nevent: changes\ndata: {json.dumps(payload)}\n\n'
+                    last_sent = time.monotonic()
+                    if payload['reset']:
+                        return
+            if time.monotonic() - last_sent >= config['LIVE_KEEPALIVE_SECONDS']:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(config['LIVE_POLL_SECONDS'])
+
+    try:
+        response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    except Exception:
+        _release_stream_slot()
+        raise
+    # The server closes the response when the stream ends or the client goes away
+    response.call_on_close(_release_stream_slot)
+    return response
+
+def _horizon_arg():
+    try:
+        return int(request.args.get('horizon', plan_optimizer.DEFAULT_HORIZON_MONTHS))
+    except ValueError:
+        raise plan_optimizer.OptimizerError('horizon must be a number of months')
+
+@bp.route('/optimizer/economics')
+@login_required
+def get_plan_economics():
+    """キャリアマスターの全プランと、最適化に使う見込み金額(キャッシュバック・初月費用・月額)。"""
+    return jsonify({'economics': plan_optimizer.economics_table(current_user.id)})
+
+@bp.route('/optimizer/economics', methods=['PUT'])
+@login_required
+def put_plan_economics():
+    """見込み金額の表を置き換える。{"economics": [...]} またはリストを受け付ける。"""
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('economics')
+    try:
+        entries = plan_optimizer.validate_economics(payload)
+    except plan_optimizer.OptimizerError as e:
+        return _bad_request(str(e))
+    plan_optimizer.save_plan_economics(current_user.id, entries)
+    return jsonify({'economics': plan_optimizer.economics_table(current_user.id)})
+
+@bp.route('/optimizer/chains')
+@login_required
+def optimize_chains():
+    """?horizon=<月数> で、すべての電話番号の利益最大の乗り換え予定(改善額の大きい順)。"""
+    try:
+        plans = plan_optimizer.optimize_all_chains(current_user.id, _horizon_arg())
+    except plan_optimizer.OptimizerError as e:
+        return _bad_request(str(e))
+    return jsonify({'count': len(plans), 'plans': plans})
+
+@bp.route('/optimizer/chains/<string:phone_number>')
+@login_required
+def optimize_chain(phone_number):
+    """?horizon=<月数> で、電話番号1つの利益最大の乗り換え予定。"""
+    try:
+        return jsonify(plan_optimizer.optimize_chain(current_user.id, phone_number, _horizon_arg()))
+    except plan_optimizer.OptimizerError as e:
+        return _bad_request(str(e))
+
+def _job_response(job):
+    """ジョブ表の内容から、サーバー上のファイルパスなどの内部の項目を除いたもの。"""
+    public = {key: job[key] for key in ('id', 'kind', 'status', 'progress', 'cancel_requested',
+                                        'created_at', 'started_at', 'finished_at', 'error')}
+    result = job['result']
+    if result is not None:
+        public['result'] = {key: value for key, value in result.items() if key != 'file'}
+        if result.get('file'):
+            public['result_url'] = url_for('api.job_result', job_id=job['id'])
+    return public
+
+@bp.route('/jobs')
+@login_required
+def list_jobs():
+    """ユーザーのジョブ(新しい順)。"""
+    return jsonify({'jobs': [_job_response(job) for job in job_queue.list_jobs(current_user.id)]})
+
+@bp.route('/jobs/<string:job_id>')
+@login_required
+def get_job(job_id):
+    """ジョブの状態と進捗。statusは queued, running, succeeded, failed, cancelled, interrupted のいずれか。"""
+    job = job_queue.get_job(current_user.id, job_id)
+    if job is None:
+        return _not_found('job not found')
+    return jsonify(_job_response(job))
+
+@bp.route('/jobs/<string:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """キャンセルを要求する。実行中のジョブは次の進捗報告の時点で止まる。"""
+    job = job_queue.cancel_job(current_user.id, job_id)
+    if job is None:
+        return _not_found('job not found')
+    return jsonify(_job_response(job))
+
+@bp.route('/jobs/<string:job_id>/result')
+@login_required
+def job_result(job_id):
+    """完了したジョブが作成したファイル(エクスポート・バックアップ)をダウンロードする。"""
+    job = job_queue.get_job(current_user.id, job_id)
+    if job is None:
+        return _not_found('job not found')
+    if job['status'] != 'succeeded':
+        return jsonify({'error': f"job is {job['status']}"}), 409
+    path = (job['result'] or {}).get('file')
+    if not path or not os.path.exists(path):
+        return _not_found('job has no result file')
+    return send_file(path, mimetype='application/json', as_attachment=True, download_name=job['result']['filename'])
+
+@bp.route('/cache/stats')
+@login_required
+def cache_stats():
+    """このワーカープロセスのテナントキャッシュと行キャッシュの使用量・ヒット数・追い出し数。"""
+    return jsonify({
+        'tenants': tenant_cache.get_cache().stats(),
+        'rows': current_app.extensions['row_cache'].stats(),
+    })
+
+@bp.route('/sync/digest')
+@login_required
+def sync_digest():
+    """ルートダイジェストとバケットダイジェスト。?root=が一致する場合はルートだけを返す。"""
+    digest = sync_service.get_user_digest(current_user.id)
+    if request.args.get('root') == digest['root']:
+        return jsonify({'root': digest['root'], 'unchanged': True})
+    return jsonify({'root': digest['root'], 'buckets': digest['buckets']})
+
+@bp.route('/sync/buckets')
+@login_required
+def sync_buckets():
+    """?ids=3,17 で指定したバケットに含まれる契約のハッシュとバージョン。"""
+    try:
+        bucket_ids = [int(b) for b in request.args.get('ids', '').split(',') if b != '']
+    except ValueError:
+        return _bad_request('ids must be a comma-separated list of bucket numbers')
+    records = sync_service.get_user_digest(current_user.id)['records']
+    return jsonify({'buckets': {str(b): records.get(b, {}) for b in bucket_ids if 0 <= b < sync_service.NUM_BUCKETS}})
+
+@bp.route('/sync/records', methods=['POST'])
+@login_required
+def sync_records():
+    """{"contract_ids": [...]} で指定した契約の全項目。"""
+    payload = request.get_json(silent=True) or {}
+    contract_ids = payload.get('contract_ids')
+    if not isinstance(contract_ids, list):
+        return _bad_request('contract_ids must be a list')
+    return jsonify({'records': sync_service.get_records(current_user.id, contract_ids)})
+
+@bp.route('/sync/push', methods=['POST'])
+@login_required
+def sync_push():
+    """変更された契約だけを適用する。競合した契約はサーバー側の内容と一緒に返す。"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return _bad_request('request body must be a JSON object')
+    upserts = payload.get('upserts', [])
+    deletes = payload.get('deletes', [])
+    if not isinstance(upserts, list) or not isinstance(deletes, list):
+        return _bad_request('upserts and deletes must be lists')
+    for change in upserts:
+        if not isinstance(change, dict) or not isinstance(change.get('record'), dict) or not change['record'].get('contract_id'):
+            return _bad_request('each upsert needs a record with a contract_id')
+    for change in deletes:
+        if not isinstance(change, dict) or not change.get('contract_id'):
+            return _bad_request('each delete needs a contract_id')
+
+    try:
+        applied, conflicts = sync_service.apply_changes(current_user.id, upserts, deletes)
+    except sync_service.SyncError as e:
+        return jsonify({'error': str(e), 'contract_id': e.contract_id}), 400
+    row_cache = current_app.extensions['row_cache']
+    for change in applied:
+        row_cache.discard(current_user.id, change['contract_id'])
+    return jsonify({
+        'applied': applied,
+        'conflicts': conflicts,
+        'root': sync_service.get_user_digest(current_user.id)['root'],
+    })
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask_login import login_user, logout_user, login_required, current_user
+from werkzeug.security import generate_password_hash
+from models.user import User
+from services.group_commit import commit
+from services.json_data_store import load_data, USERS_FILE, generate_next_id
+
+bp = Blueprint('auth', __name__)
+
+def load_user(user_id):
+    users_data = load_data(USERS_FILE)
+    for user_dict in users_data:
+        if user_dict['id'] == int(user_id):
+            return User(**user_dict)
+    return None
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if current_user.is_authenticated:
+        return redirect(url_for('contracts.index'))
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        users_data = load_data(USERS_FILE)
+        user = None
+        for u_data in users_data:
+            if u_data['username'] == username:
+                user = User(**u_data)
+                break
+
+        if user and user.check_password(password):
+            login_user(user)
+            return redirect(url_for('contracts.index'))
+        else:
+            flash('ユーザー名またはパスワードが無効です')
+    return render_template('login.html')
+
+@bp.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    return redirect(url_for('auth.login'))
+
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    if current_user.is_authenticated:
+        return redirect(url_for('contracts.index'))
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        password_hash = generate_password_hash(password)
+
+        def add_user(users):
+            if any(u['username'] == username for u in users):
+                return False
+            users.append({
+                'id': generate_next_id(users),
+                'username': username,
+                'password_hash': password_hash
+            })
+            return True
+
+        if not commit(USERS_FILE, add_user):
+            flash('ユーザー名はすでに存在します')
+        else:
+            flash('登録が完了しました。ログインしてください。')
+            return redirect(url_for('auth.login'))
+    return render_template('register.html')
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+import os
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash
+from jinja2.utils import htmlsafe_json_dumps
+from markupsafe import Markup
+from flask_login import login_required, current_user
+from models.contract import Contract
+from services import change_feed, contract_jobs, job_queue, tenant_cache
+from services.group_commit import commit
+from services.query_engine import QueryError, get_user_index, parse_filter
+from services.json_data_store import ContractShard, file_signature, job_dir, load_data, user_carriers_file, generate_next_id, generate_contract_id, stamp_version
+
+bp = Blueprint('contracts', __name__)
+
+# フォームから受け取る整数項目
+INT_FORM_FIELDS = ('initial_fee', 'first_month_cost', 'monthly_cost', 'cashback_amount', 'device_cost', 'device_resale_value')
+TEXT_FORM_FIELDS = ('contract_date', 'scheduled_termination_date', 'phone_number', 'contractor_name', 'carrier_name',
+                    'plan_name', 'sim_id_last_5_digits', 'device_type', 'memo')
+
+def _contract_fields_from_form(form):
+    fields = {name: form.get(name) for name in TEXT_FORM_FIELDS}
+    for name in INT_FORM_FIELDS:
+        fields[name] = int(form.get(name) or 0)
+    return fields
+
+def _carriers_for_js(user_id):
+    """契約フォームのJavaScriptに渡す、ユーザーのキャリアとプランの一覧を作る。"""
+    carriers_for_js = []
+    for carrier_data in load_data(user_carriers_file(user_id)):
+        carrier_dict = {
+            'carrier_name': carrier_data.get('carrier_name', ''),
+            'plans': []
+        }
+        # Plans are directly in carrier_data['plans']
+        if isinstance(carrier_data.get('plans'), list):
+            for plan_data in carrier_data['plans']:
+                carrier_dict['plans'].append({
+                    'plan_name': plan_data.get('plan_name', ''),
+                    'initial_fee': plan_data.get('initial_fee', 0),
+                    'minimum_maintenance_period': plan_data.get('minimum_maintenance_period', 0)
+                })
+        carriers_for_js.append(carrier_dict)
+    return carriers_for_js
+
+def _carrier_catalog(user_id):
+    """契約フォーム用のキャリア一覧と、そのJavaScript用JSON。キャリアマスターが変わるまで再利用する。"""
+    def build():
+        carriers = _carriers_for_js(user_id)
+        return {'carriers': carriers, 'json': htmlsafe_json_dumps(carriers)}
+    return tenant_cache.cached(user_id, 'carrier_catalog', file_signature(user_carriers_file(user_id)), build)
+
+def _carrier_form_args(user_id):
+    catalog = _carrier_catalog(user_id)
+    return {'all_carriers': catalog['carriers'], 'all_carriers_json': catalog['json']}
+
+def _build_row_item(contract_index, pos):
+    contract = contract_index.contracts[pos]
+    return {
+        'contract': contract,
+        'financials': contract.calculate_financials(),
+        'chain_total_balance': contract_index.chain_balances[pos],
+        'contract_duration_days': contract.calculate_duration_days()
+    }
+
+def render_row_fragments(user_id, contract_index, positions):
+    """索引上の位置(positions)の契約ごとに<tr>のHTMLを返す。変更のない行はキャッシュから再利用する。"""
+    row_cache = current_app.extensions['row_cache']
+    row_template = current_app.jinja_env.get_template('_contract_row.html')
+    rows = []
+    for pos in positions:
+        contract_data = contract_index.records[pos]
+        contract_id = contract_data.get('contract_id')
+        version_key = (contract_data.get('version'), contract_index.chain_versions.get(contract_data.get('phone_number')))
+        html = row_cache.get(user_id, contract_id, version_key) if contract_id else None
+        if html is None:
+            html = row_template.render(item=_build_row_item(contract_index, pos))
+            if contract_id:
+                row_cache.put(user_id, contract_id, version_key, html)
+        rows.append(html)
+    return rows
+
+def _render_rows(user_id, contract_index, positions):
+    """契約一覧の<tr>を連結したHTMLを返す。"""
+    return Markup(''.join(render_row_fragments(user_id, contract_index, positions)))
+
+def matches_search(contract_data, search_query):
+    """一覧の検索欄の条件(キャリア名か電話番号の部分一致)を満たすか。"""
+    if not search_query:
+        return True
+    needle = search_query.lower()
+    return bool((contract_data.get('carrier_name') and needle in contract_data['carrier_name'].lower()) or
+                (contract_data.get('phone_number') and needle in contract_data['phone_number'].lower()))
+
+@bp.route('/')
+@login_required
+def index():
+    search_query = request.args.get('search', '')
+    filter_query = request.args.get('filter', '')
+    # The shard holds only this user's contracts; chains are computed over the unfiltered list
+    contract_index = get_user_index(current_user.id)
+    positions = range(len(contract_index))
+    if filter_query:
+        try:
+            positions = contract_index.query_positions(parse_filter(filter_query))
+        except QueryError as e:
+            flash(f'絞り込み条件が不正です: {e}', 'danger')
+            positions = []
+    if search_query:
+        positions = [pos for pos in positions if matches_search(contract_index.records[pos], search_query)]
+
+    rows_html = _render_rows(current_user.id, contract_index, positions)
+    # ページが反映済みの変更のバージョン。ライブ更新はこれより後の変更だけを受け取る
+    version = change_feed.current_version(current_user.id, contract_index)
+    return render_template('index.html', rows_html=rows_html, search_query=search_query, filter_query=filter_query,
+                           version=version, poll_seconds=current_app.config['LIVE_POLL_FALLBACK_SECONDS'])
+
+@bp.route('/contract/new', methods=['GET', 'POST'])
+@login_required
+def new_contract():
+    if request.method == 'POST':
+        new_contract_data = {
+            **_contract_fields_from_form(request.form),
+            'user_id': current_user.id
+        }
+
+        def add(contracts):
+            new_contract_data['id'] = generate_next_id(contracts)
+            new_contract_data['contract_id'] = generate_contract_id(contracts)
+            stamp_version(new_contract_data)
+            contracts.append(new_contract_data)
+
+        commit(ContractShard(current_user.id), add)
+        flash('契約が正常に追加されました。', 'success')
+        return redirect(url_for('contracts.index'))
+    
+    return render_template('contract_form.html', form_title='新規契約', contract={}, **_carrier_form_args(current_user.id))
+
+@bp.route('/contract/edit/<string:contract_id>', methods=['GET', 'POST'])
+@login_required
+def edit_contract(contract_id):
+    shard = ContractShard(current_user.id)
+    if request.method == 'POST':
+        fields = _contract_fields_from_form(request.form)
+
+        def update(contracts):
+            contract_data = next((c for c in contracts if c.get('contract_id') == contract_id), None)
+            if contract_data is not None:
+                contract_data.update(fields)
+                stamp_version(contract_data)
+            return contract_data
+
+        if commit(shard, update) is None:
+            flash('契約が見つかりません。', 'danger')
+            return redirect(url_for('contracts.index'))
+        current_app.extensions['row_cache'].discard(current_user.id, contract_id)
+        flash('契約が正常に更新されました。', 'success')
+        return redirect(url_for('contracts.index'))
+
+    contract_data = shard.load_one(contract_id)
+    if not contract_data:
+        # Simulate 404 if contract not found
+        flash('契約が見つかりません。', 'danger')
+        return redirect(url_for('contracts.index'))
+    contract = Contract.from_dict(contract_data)
+    return render_template('contract_form.html', form_title='契約編集', contract=contract, **_carrier_form_args(current_user.id))
+
+@bp.route('/contract/delete/<string:contract_id>', methods=['POST'])
+@login_required
+def delete_contract(contract_id):
+    def delete(contracts):
+        initial_len = len(contracts)
+        contracts[:] = [c for c in contracts if c.get('contract_id') != contract_id]
+        return len(contracts) < initial_len
+
+    if commit(ContractShard(current_user.id), delete):
+        current_app.extensions['row_cache'].discard(current_user.id, contract_id)
+        flash('契約が正常に削除されました。', 'success')
+    else:
+        flash('契約が見つからないか、認証されていません。', 'danger')
+    return redirect(url_for('contracts.index'))
+
+def _submit_job(kind, fn, *args, job_id=None):
+    """ジョブを登録してジョブの進捗ページへ移動する。"""
+    try:
+        job = job_queue.submit(current_user.id, kind, fn, *args, job_id=job_id)
+    except job_queue.JobQueueFull:
+        flash('処理待ちのジョブが多すぎます。しばらくしてから再度お試しください。', 'danger')
+        return redirect(url_for('contracts.index'))
+    return redirect(url_for('contracts.job_status', job_id=job['id']))
+
+@bp.route('/export/contracts', methods=['POST'])
+@login_required
+def export_contracts():
+    # POST only: every request queues a job, which link prefetchers and reloads must not do
+    filter_query = request.form.get('filter', '')
+    try:
+        parse_filter(filter_query)
+    except QueryError as e:
+        flash(f'絞り込み条件が不正です: {e}', 'danger')
+        return redirect(url_for('contracts.index'))
+    return _submit_job('export', contract_jobs.export_contracts, current_user.id, filter_query)
+
+@bp.route('/import/contracts', methods=['POST'])
+@login_required
+def import_contracts():
+    if 'file' not in request.files:
+        flash('ファイルが選択されていません', 'danger')
+        return redirect(url_for('contracts.index'))
+    file = request.files['file']
+    if file.filename == '':
+        flash('ファイルが選択されていません', 'danger')
+        return redirect(url_for('contracts.index'))
+    if not file.filename.endswith('.json'):
+        flash('JSONファイルをアップロードしてください', 'danger')
+        return redirect(url_for('contracts.index'))
+    # The upload is parsed and merged by the job; the request only stores it. submit() removes it
+    # again if the job cannot be queued.
+    job_id = job_queue.new_job_id()
+    upload_dir = job_dir(job_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    upload_path = os.path.join(upload_dir, 'upload.json')
+    file.save(upload_path)
+    return _submit_job('import', contract_jobs.import_contracts, current_user.id, upload_path, job_id=job_id)
+
+@bp.route('/backup', methods=['POST'])
+@login_required
+def backup_contracts():
+    return _submit_job('backup', contract_jobs.backup_contracts, current_user.id)
+
+@bp.route('/jobs/<string:job_id>')
+@login_required
+def job_status(job_id):
+    job = job_queue.get_job(current_user.id, job_id)
+    if job is None:
+        flash('ジョブが見つかりません。', 'danger')
+        return redirect(url_for('contracts.index'))
+    return render_template('job.html', job_id=job_id, kind=job['kind'])